@@ -4,6 +4,8 @@ import re
 import subprocess
 import typing
 import io
+import asyncio
+import time
 
 from discord.ext import commands, menus
 from selenium import webdriver
@@ -11,21 +13,119 @@ from selenium.common.exceptions import InvalidArgumentException, WebDriverExcept
 from selenium.webdriver.chrome.options import Options
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, PB_Bot
 from config import config
 
 # constants
 
 SUPPORT_SERVER_ID = 798329404325101600
-options = Options()
-options.add_argument("--headless")
-driver = webdriver.Chrome(config["webdriver_path"], chrome_options=options)
+SCREENSHOT_WORKERS = config.get("webdriver_workers", 2)
+SCREENSHOT_TIMEOUT = 30
+SCREENSHOT_QUEUE_SIZE = 20
+SCREENSHOT_CACHE_TTL = 60  # set to 0 to disable
+
+
+def create_driver():
+    options = Options()
+    options.add_argument("--headless")
+    driver = webdriver.Chrome(config["webdriver_path"], chrome_options=options)
+    driver.set_page_load_timeout(SCREENSHOT_TIMEOUT)
+    return driver
+
+
+class BrowserPool:
+    """
+    A pool of headless browsers. Each worker owns one browser and takes jobs from a shared queue, so screenshots
+    never race on the same browser and none of the blocking selenium calls run on the event loop.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, workers: int, timeout: float, cache_ttl: float):
+        self.loop = loop
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache = {}
+        self.drivers = set()
+        self.queue = asyncio.Queue(maxsize=SCREENSHOT_QUEUE_SIZE)
+        self.workers = [loop.create_task(self.worker()) for _ in range(workers)]
+
+    @staticmethod
+    def _screenshot(driver, url: str):
+        driver.get(url)
+        return driver.get_screenshot_as_png()
+
+    async def _discard(self, driver):
+        # quitting the browser also unblocks a thread that is still stuck on it
+        self.drivers.discard(driver)
+        try:
+            await self.loop.run_in_executor(None, driver.quit)
+        except WebDriverException:
+            pass
+
+    async def worker(self):
+        driver = None
+        while True:
+            url, future = await self.queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                if driver is None:
+                    driver = await self.loop.run_in_executor(None, create_driver)
+                    self.drivers.add(driver)
+                png = await asyncio.wait_for(
+                    self.loop.run_in_executor(None, self._screenshot, driver, url), timeout=self.timeout)
+            except InvalidArgumentException as e:  # bad url, the browser is fine
+                if not future.done():
+                    future.set_exception(e)
+            except Exception as e:  # browser hung, crashed or failed to start, start a fresh one
+                if driver is not None:
+                    self.loop.create_task(self._discard(driver))
+                    driver = None
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if self.cache_ttl:
+                    self.cache[url] = (time.monotonic(), png)
+                if not future.done():
+                    future.set_result(png)
+            finally:
+                self.queue.task_done()
+
+    def get_cached(self, url: str):
+        now = time.monotonic()
+        for key, (created, _) in list(self.cache.items()):
+            if now - created >= self.cache_ttl:
+                del self.cache[key]
+        if (entry := self.cache.get(url)) is not None:
+            return entry[1]
+
+    async def screenshot(self, url: str):
+        """
+        Screenshots a webpage. Raises `asyncio.QueueFull` if too many screenshots are already waiting.
+        """
+        if self.cache_ttl and (png := self.get_cached(url)) is not None:
+            return png
+        future = self.loop.create_future()
+        self.queue.put_nowait((url, future))
+        return await future
+
+    async def close(self):
+        for task in self.workers:
+            task.cancel()
+        for driver in self.drivers.copy():
+            await self._discard(driver)
 
 
 class Admin(commands.Cog):
     """
     Commands that only my owner can use.
     """
+    def __init__(self, bot: PB_Bot):
+        self.browsers = BrowserPool(
+            bot.loop, workers=SCREENSHOT_WORKERS, timeout=SCREENSHOT_TIMEOUT, cache_ttl=SCREENSHOT_CACHE_TTL)
+        self.bot = bot
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.browsers.close())
+
     async def cog_check(self, ctx: CustomContext):
         if not await ctx.bot.is_owner(ctx.author):
             raise commands.NotOwner
@@ -322,6 +422,89 @@ class Admin(commands.Cog):
 
         await ctx.send(embed=embed)
 
+    @admin.command(aliases=["cs"])
+    async def cachestats(self, ctx: CustomContext):
+        """
+        View the hit ratios of the http cache.
+        """
+        http_cache = ctx.bot.http_cache
+        table = utils.PrettyTable.default(["Host", "Hits", "Revalidated", "Misses", "Hit Ratio"])
+        for host, counter in sorted(http_cache.stats.items(), key=lambda item: str(item[0])):
+            table.add_row((host, counter["hits"], counter["revalidations"], counter["misses"],
+                           f"{http_cache.hit_ratio(counter):.1%}"))
+        embed = discord.Embed(
+            title="Cache Stats",
+            description=f"```\n{table.build_table(autoscale=True)}```" if http_cache.stats else "Nothing has been cached yet.",
+            colour=ctx.bot.embed_colour)
+        embed.add_field(name="HTTP Cache",
+                        value=f"`{len(http_cache.entries)}` entries, `{http_cache.hit_ratio(http_cache.totals):.1%}` hit ratio, "
+                              f"`{http_cache.flights.coalesced}` coalesced requests")
+        if (info := ctx.bot.get_cog("Info")) is not None:
+            definitions = info.definitions
+            embed.add_field(name="Definition Cache",
+                            value=f"`{definitions.hit_ratio:.1%}` hit ratio, "
+                                  f"`{definitions.stats['upstream_calls']}` upstream calls, "
+                                  f"`{definitions.calls_avoided}` calls avoided", inline=False)
+        if (music := ctx.bot.get_cog("Music")) is not None:
+            track_cache = music.track_cache
+            top_guilds = sorted(track_cache.stats.items(), key=lambda item: item[1]["hits"], reverse=True)[:5]
+            embed.add_field(name="Track Search Cache",
+                            value=f"`{http_cache.hit_ratio(track_cache.totals):.1%}` hit ratio overall\n" + "\n".join(
+                                f"`{ctx.bot.get_guild(guild_id) or guild_id}`: `{counter['hits']}` hits, "
+                                f"`{http_cache.hit_ratio(counter):.1%}` hit ratio" for guild_id, counter in top_guilds),
+                            inline=False)
+        await ctx.send(embed=embed)
+
+    @admin.command(aliases=["hs"])
+    async def httpstats(self, ctx: CustomContext):
+        """
+        View latency and circuit breaker info for every host the bot has made requests to, and paste provider stats.
+        """
+        rows = sorted(ctx.bot.session.hosts.items())
+        pages = []
+        for i in range(0, len(rows), 15):
+            table = utils.PrettyTable.default(["Host", "Requests", "Failures", "Avg", "P95", "Breaker"])
+            for host, stats in rows[i:i + 15]:
+                table.add_row((host, stats.requests, stats.failures, f"{stats.average * 1000:.0f}ms",
+                               f"{stats.p95 * 1000:.0f}ms", stats.breaker.state))
+            pages.append(table.build_table(autoscale=True))
+
+        table = utils.PrettyTable.default(["Paste Provider", "Successes", "Failures", "Avg"])
+        for provider in ctx.bot.paste_service.providers.values():
+            table.add_row((provider.name, provider.successes, provider.failures, f"{provider.average * 1000:.0f}ms"))
+        pages.append(table.build_table(autoscale=True))
+        await menus.MenuPages(utils.PaginatorSource(pages, per_page=1), delete_message_after=True).start(ctx)
+
+    @admin.command()
+    async def nodes(self, ctx: CustomContext):
+        """
+        View stats for every lavalink node.
+        """
+        if (music := ctx.bot.get_cog("Music")) is None:
+            return await ctx.send("The music cog isn't loaded.")
+        table = utils.PrettyTable.default(["Node", "Available", "Players", "Playing", "CPU", "Deficit", "Penalty", "Migrated"])
+        for identifier, node in ctx.bot.wavelink.nodes.items():
+            stats = node.stats
+            table.add_row((identifier, node.is_available, len(node.players),
+                           stats.playing_players if stats else "-",
+                           f"{stats.lavalink_load:.1%}" if stats else "-",
+                           stats.frames_deficit if stats else "-",
+                           f"{node.penalty:.0f}" if stats else "-",
+                           music.migrations[identifier]))
+        best_node = music.best_node()
+        reaped = ", ".join(f"`{count}` {reason}" for reason, count in music.reaped.items()) or "`0`"
+        if gaps := sorted(music.gaps):
+            gap = (f"`{gaps[len(gaps) // 2] * 1000:.0f}ms` median, `{gaps[int(len(gaps) * 0.95)] * 1000:.0f}ms` p95 "
+                   f"over the last `{len(gaps)}` songs")
+        else:
+            gap = "`no songs yet`"
+        await ctx.send(f"```\n{table.build_table(autoscale=True)}```"
+                       f"New players go to: `{best_node.identifier if best_node else 'nowhere (no available nodes)'}`\n"
+                       f"Idle players reclaimed: {reaped}\n"
+                       f"Gap between songs: {gap}\n"
+                       f"Message edits: " + ", ".join(f"`{count}` {stat}" for stat, count in ctx.bot.edit_scheduler.stats.items()) +
+                       f" (`{len(ctx.bot.edit_scheduler.live)}` live, `{len(ctx.bot.edit_scheduler.pending)}` pending)")
+
     @admin.command(aliases=["ss"])
     async def screenshot(self, ctx: CustomContext, url: str):
         """
@@ -332,13 +515,16 @@ class Admin(commands.Cog):
         async with ctx.typing():
             with utils.StopWatch() as sw:
                 try:
-                    await ctx.bot.loop.run_in_executor(None, driver.get, url)
+                    png = await self.browsers.screenshot(url)
+                except asyncio.QueueFull:
+                    return await ctx.send("Too many screenshots are queued right now. Try again in a bit.")
                 except InvalidArgumentException:
                     return await ctx.send("Invalid url provided (did you forget the `http://` or `https://`?).")
+                except asyncio.TimeoutError:
+                    return await ctx.send(f"The webpage took too long to load (>{SCREENSHOT_TIMEOUT} seconds).")
                 except WebDriverException:
                     return await ctx.send("Couldn't screenshot that webpage.")
-            b = io.BytesIO(driver.get_screenshot_as_png())
-            file = discord.File(b, filename="screenshot.png")
+            file = discord.File(io.BytesIO(png), filename="screenshot.png")
             embed = discord.Embed(colour=ctx.bot.embed_colour, timestamp=datetime.datetime.now())
             embed.set_image(url="attachment://screenshot.png")
             embed.set_footer(text=f"Finished in {sw.elapsed:.3f} seconds")
@@ -346,4 +532,4 @@ class Admin(commands.Cog):
 
 
 def setup(bot):
-    bot.add_cog(Admin())
+    bot.add_cog(Admin(bot))
@@ -4,6 +4,7 @@ import humanize
 import psutil
 import sys
 import inspect
+import asyncio
 
 from discord.ext import commands, menus
 from jishaku import Jishaku
@@ -103,10 +104,12 @@ class BotInfo(commands.Cog, name="Bot Info"):
         m = p.memory_full_info()
         top5commands_today = ctx.bot.cache.command_stats["top_commands_today"].most_common(5)
         uptime = datetime.datetime.now() - ctx.bot.start_time
-        recent_commits = await ctx.bot.get_recent_commits()
+        # run the probes concurrently so this is only as slow as the slowest one
+        recent_commits, *pings = await asyncio.gather(
+            ctx.bot.get_recent_commits(), ctx.bot.api_ping(ctx), ctx.bot.postgresql_ping(), ctx.bot.redis_ping())
         latencies = {k: f"{v * 1000:.2f}ms" for k, v in zip(
             ["Websocket Latency", "API Response Time", "Database Ping (postgresql)", "Database Ping (redis)"],
-            [ctx.bot.latency, await ctx.bot.api_ping(ctx), await ctx.bot.postgresql_ping(), await ctx.bot.redis_ping()]
+            [ctx.bot.latency, *pings]
         )}
 
         embed = discord.Embed(title="Bot Info", colour=ctx.bot.embed_colour)
@@ -124,7 +127,7 @@ class BotInfo(commands.Cog, name="Bot Info"):
         embed.add_field(
             name="What's New",
             value="\n".join(f"[`{commit['sha'][:6]}`]({commit['html_url']}) {commit['commit']['message']}"
-                            for commit in recent_commits), inline=False)
+                            for commit in recent_commits) or "Couldn't fetch the latest commits.", inline=False)
 
         embed.add_field(name="Top 5 Commands Today", value=top5(top5commands_today) or "No commands have been used today.")
 
@@ -8,6 +8,7 @@ from discord.ext import commands
 
 from utils import utils
 from utils.classes import CustomContext, StopSpammingMe
+from utils.web import CircuitOpen, PasteFailed, TextTooLarge, UpstreamUnavailable
 
 
 class ErrorHandling(commands.Cog):
@@ -54,6 +55,18 @@ class ErrorHandling(commands.Cog):
         elif isinstance(error, StopSpammingMe):
             await ctx.send(f"{ctx.author.mention}, please stop spamming me.")
 
+        elif isinstance(error, CircuitOpen):
+            await ctx.send(f"`{error.host}` isn't responding right now. Try again in `{error.retry_after:.0f}` seconds.")
+
+        elif isinstance(error, TextTooLarge):
+            await ctx.send(str(error))
+
+        elif isinstance(error, PasteFailed):
+            await ctx.send("Couldn't upload to any paste service right now. Try again later.")
+
+        elif isinstance(error, UpstreamUnavailable):
+            await ctx.send("An external service took too long to respond or couldn't be reached. Try again later.")
+
         elif isinstance(error, discord.HTTPException):
             embed = discord.Embed(
                 title=f"An HTTP Exception Occurred",
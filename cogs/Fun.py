@@ -6,15 +6,108 @@ import humanize
 import datetime
 
 from discord.ext import commands
+from collections import OrderedDict
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, PB_Bot
+
+# constants
+
+REDDIT_POOL_TTL = 300
+REDDIT_POOL_WATERMARK = 5  # refill in the background once a pool has fewer posts than this
+REDDIT_MAX_SUBREDDITS = 200
+REDDIT_POST_FIELDS = ("title", "url", "author", "ups", "downs", "created", "subreddit_name_prefixed", "num_comments",
+                      "upvote_ratio", "over_18")
+
+
+class SubredditPool:
+    __slots__ = ("posts", "exists", "fetched_at", "refill_task", "failed")
+
+    def __init__(self):
+        self.posts = []
+        self.exists = True
+        self.fetched_at = 0.0
+        self.refill_task = None
+        self.failed = False  # whether the last refill raised
+
+    @property
+    def stale(self):
+        return time.monotonic() - self.fetched_at > REDDIT_POOL_TTL
+
+
+class RedditPool:
+    """
+    Pools of already parsed posts for recently used subreddits. Posts are handed out without replacement and the
+    listing is only downloaded (and parsed) again when a pool runs low or goes stale.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.pools = OrderedDict()
+
+    async def _refill(self, subreddit: str, pool: SubredditPool):
+        try:
+            async with self.bot.session.get(f"https://www.reddit.com/r/{subreddit}/new.json") as resp:
+                r = await resp.json()
+        except Exception:
+            pool.failed = True
+            raise
+        pool.failed = False
+        pool.fetched_at = time.monotonic()
+        if r.get("error", None) is not None:
+            pool.exists = False
+            pool.posts = []
+            return
+        pool.exists = True
+        pool.posts = [{k: post["data"][k] for k in REDDIT_POST_FIELDS} for post in r["data"]["children"]]
+
+    def refill(self, subreddit: str, pool: SubredditPool):
+        if pool.refill_task is None or pool.refill_task.done():
+            pool.refill_task = self.bot.loop.create_task(self._refill(subreddit, pool))
+        return pool.refill_task
+
+    def refill_in_background(self, subreddit: str, pool: SubredditPool):
+        task = self.refill(subreddit, pool)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # errors are retried by the next get_post
+
+    def get_pool(self, subreddit: str):
+        if (pool := self.pools.get(subreddit)) is None:
+            pool = self.pools[subreddit] = SubredditPool()
+            if len(self.pools) > REDDIT_MAX_SUBREDDITS:
+                self.pools.popitem(last=False)
+        self.pools.move_to_end(subreddit)
+        return pool
+
+    async def get_post(self, subreddit: str):
+        """
+        Returns a tuple of whether the subreddit exists and a random post (`None` if it doesn't have any).
+        """
+        subreddit = subreddit.lower()
+        pool = self.get_pool(subreddit)
+        # an empty pool whose last refill failed is retried here, so the error reaches the user instead of "no posts"
+        if not pool.posts and (pool.stale or pool.failed or pool.refill_task is not None and not pool.refill_task.done()):
+            await asyncio.shield(self.refill(subreddit, pool))
+        elif pool.stale:
+            self.refill_in_background(subreddit, pool)  # serve what we have in the meantime
+
+        if not pool.posts:
+            return pool.exists, None
+        # swap with the last post and pop so that taking a post is O(1)
+        index = random.randrange(len(pool.posts))
+        pool.posts[index], pool.posts[-1] = pool.posts[-1], pool.posts[index]
+        post = pool.posts.pop()
+
+        if len(pool.posts) < REDDIT_POOL_WATERMARK:
+            self.refill_in_background(subreddit, pool)
+        return pool.exists, post
 
 
 class Fun(commands.Cog):
     """
     Fun commands.
     """
+    def __init__(self, bot: PB_Bot):
+        self.reddit_pool = RedditPool(bot)
+
     @commands.command()
     async def coinflip(self, ctx: CustomContext):
         """
@@ -32,15 +125,11 @@ class Fun(commands.Cog):
 
         `subreddit` - The subreddit.
         """
-        async with ctx.bot.session.get(f"https://www.reddit.com/r/{subreddit}/new.json") as resp:
-            r = await resp.json()
-        if r.get("error", None) is not None:
+        exists, random_post = await self.reddit_pool.get_post(subreddit)
+        if not exists:
             return await ctx.send("Couldn't find a subreddit with that name.")
-
-        posts = r["data"]["children"]
-        if not posts:
+        if random_post is None:
             return await ctx.send("Apparently there are no posts in this subreddit...")
-        random_post = random.choice(posts)["data"]
         posted_when = datetime.datetime.now() - datetime.datetime.fromtimestamp(random_post["created"])
 
         embed = discord.Embed(
@@ -81,18 +170,13 @@ class Fun(commands.Cog):
         await message.add_reaction(reaction)
         start = time.perf_counter()
         try:
-            _, user = await ctx.bot.wait_for(
-                "reaction_add",
-                check=lambda _reaction, user: _reaction.message.guild == ctx.guild
-                and _reaction.message.channel == ctx.message.channel
-                and _reaction.message == message and str(_reaction.emoji) == reaction and user != ctx.bot.user
-                and not user.bot,
-                timeout=60)
+            _, payload = await ctx.bot.reaction_router.wait_for(message, emojis={reaction}, timeout=60)
         except asyncio.TimeoutError:
             return await message.edit(embed=discord.Embed(
                 description="No one ate the cookie...",
                 colour=ctx.bot.embed_colour))
         end = time.perf_counter()
+        user = payload.member or ctx.bot.get_user(payload.user_id)
         await message.edit(embed=discord.Embed(
             description=f"**{user}** ate the cookie in `{end - start:.3f}` seconds!",
             colour=ctx.bot.embed_colour))
@@ -120,17 +204,11 @@ class Fun(commands.Cog):
         await msg.add_reaction("\N{WHITE HEAVY CHECK MARK}")
         await msg.add_reaction("\N{CROSS MARK}")
         try:
-            response, _ = await ctx.bot.wait_for(
-                "reaction_add",
-                check=lambda reaction, user: reaction.message.guild == ctx.guild
-                and reaction.message.channel == ctx.message.channel
-                and reaction.message == msg
-                and str(reaction.emoji) in ["\N{WHITE HEAVY CHECK MARK}", "\N{CROSS MARK}"]
-                and user == player2,
-                timeout=300)
+            _, response = await ctx.bot.reaction_router.wait_for(
+                msg, emojis={"\N{WHITE HEAVY CHECK MARK}", "\N{CROSS MARK}"}, user_ids={player2.id}, timeout=300)
         except asyncio.TimeoutError:
             return await ctx.send(f"**{player2}** took too long to respond. {msg.jump_url}")
-        if response.emoji == "\N{CROSS MARK}":
+        if str(response.emoji) == "\N{CROSS MARK}":
             return await ctx.send(f"**{player2}** has declined your challenge {ctx.author.mention}.")
         ttt = utils.TicTacToe(ctx, ctx.author, player2)
         await ttt.start()
@@ -175,4 +253,4 @@ class Fun(commands.Cog):
 
 
 def setup(bot):
-    bot.add_cog(Fun())
+    bot.add_cog(Fun(bot))
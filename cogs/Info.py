@@ -2,18 +2,170 @@ import discord
 import humanize
 import datetime
 import json
+import asyncio
 
-from discord.ext import commands, menus
+from discord.ext import commands, menus, tasks
 from collections import Counter
+from urllib.parse import quote
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, PB_Bot
+from utils.web import CircuitOpen, SingleFlight, UpstreamUnavailable
+
+# constants
+
+STATUS_SUMMARY_URL = "https://srhpyqt94yxb.statuspage.io/api/v2/summary.json"
+STATUS_INCIDENTS_URL = "https://srhpyqt94yxb.statuspage.io/api/v2/incidents.json"
+STATUS_REFRESH_INTERVAL = 60
+DEFINE_TTL = 30 * 86400
+DEFINE_NOT_FOUND_TTL = 86400
+
+
+class DefinitionCache:
+    """
+    Definitions cached in redis in a compact, pre-normalized form. Words without definitions are cached as well.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.flights = SingleFlight()
+        self.stats = Counter()
+
+    @property
+    def calls_avoided(self):
+        return self.stats["hits"] + self.stats["negative_hits"] + self.flights.coalesced
+
+    @property
+    def hit_ratio(self):
+        total = self.stats["hits"] + self.stats["negative_hits"] + self.stats["upstream_calls"]
+        if not total:
+            return 0.0
+        return (self.stats["hits"] + self.stats["negative_hits"]) / total
+
+    @staticmethod
+    def normalize(entry: dict):
+        phonetic = next((p for p in entry.get("phonetics", []) if p.get("text")), {})
+        return {
+            "word": entry["word"],
+            "phonetic": phonetic.get("text"),
+            "audio": phonetic.get("audio"),
+            "meanings": [
+                [meaning["partOfSpeech"], [[d["definition"], d.get("example")] for d in meaning["definitions"]]]
+                for meaning in entry["meanings"]
+            ]
+        }
+
+    async def _fetch(self, word: str):
+        self.stats["upstream_calls"] += 1
+        async with self.bot.session.get(f"https://api.dictionaryapi.dev/api/v2/entries/en/{quote(word)}") as r:
+            if r.status != 404:
+                r.raise_for_status()  # don't cache server errors as "not found"
+            response = await r.json()
+        data = None if isinstance(response, dict) else self.normalize(response[0])
+        await self.bot.redis.set(
+            f"define:{word}", json.dumps(data, separators=(",", ":")),
+            expire=DEFINE_NOT_FOUND_TTL if data is None else DEFINE_TTL)
+        return data
+
+    async def get(self, word: str):
+        """
+        Returns the normalized definitions for a word, or `None` if there aren't any.
+        """
+        word = " ".join(word.lower().split())
+        if (cached := await self.bot.redis.get(f"define:{word}", encoding="utf-8")) is not None:
+            data = json.loads(cached)
+            self.stats["hits" if data is not None else "negative_hits"] += 1
+            return data
+        return await self.flights.do(word, self._fetch, word)
 
 
 class Info(commands.Cog):
     """
     Information commands.
     """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.definitions = DefinitionCache(bot)
+
+        # discord status snapshot
+        self.status_bodies = None
+        self.status_built_on = None
+        self.status_embeds = None
+        self.history_embeds = None
+        self.refresh_status.start()
+
+    def cog_unload(self):
+        self.refresh_status.cancel()
+
+    def build_status_embeds(self, summary: dict):
+        # embed 1
+        embed1 = discord.Embed(
+            title="Discord Status\nCurrent Status for Discord",
+            description="```yaml\n"
+                        f"Message: {summary['status']['description']}\n"
+                        f"Impact: {summary['status']['indicator'].title()}\n"
+                        "```",
+            colour=self.bot.embed_colour
+        )
+
+        # embed 2
+        embed2 = discord.Embed(title="Discord Status\nCurrent Incidents", colour=self.bot.embed_colour)
+        if not summary["incidents"]:
+            embed2.description = "```yaml\nThere are no issues with discord as of yet.```"
+        else:
+            embed2.description = "```yaml\n" + "\n\n".join(
+                f"Name: {incident.get('name', None)}\n"
+                f"Message: {incident.get('message', None)}\n"
+                f"Status: {incident.get('status', None).title()}\n"
+                f"Impact: {incident.get('impact', None).title()}" for incident in summary["incidents"]
+            ) + "```"
+
+        # embed 3
+        components = {c["name"]: c["status"].title().replace("_", " ") for c in summary["components"]}
+        embed3 = discord.Embed(
+            title="Discord Status\nComponents",
+            description=f"```yaml\n{utils.padding(components, separator=': ')}```",
+            colour=self.bot.embed_colour)
+
+        return [embed1, embed2, embed3]
+
+    def build_history_embeds(self, incidents: list):
+        return [
+            discord.Embed(
+                title="Discord Status\nHistorical Data",
+                description="```yaml\n"
+                            f"Name: {incident['name']}\n"
+                            f"Status: {incident['status'].title()}\n"
+                            f"Created: {humanize.naturaldate(utils.parse_timestamp(incident['created_at'])).title()}\n"
+                            f"Impact: {incident['impact'].title()}"
+                            f"```",
+                colour=self.bot.embed_colour)
+            for incident in incidents
+        ]
+
+    @tasks.loop(seconds=STATUS_REFRESH_INTERVAL)
+    async def refresh_status(self):
+        try:
+            # ttl=0 makes every poll a conditional request, so an unchanged page only costs a 304
+            summary, incidents = await asyncio.gather(
+                self.bot.http_cache.get(STATUS_SUMMARY_URL, ttl=0),
+                self.bot.http_cache.get(STATUS_INCIDENTS_URL, ttl=0))
+        except (CircuitOpen, UpstreamUnavailable):
+            return  # keep serving the last snapshot
+        if summary.status != 200 or incidents.status != 200:
+            return
+
+        today = datetime.date.today()  # "Created" is relative to today, so rebuild when the date changes too
+        if (summary.body, incidents.body) == self.status_bodies and today == self.status_built_on:
+            return
+        self.status_embeds = self.build_status_embeds(summary.json())
+        self.history_embeds = self.build_history_embeds(incidents.json()["incidents"])
+        self.status_bodies = (summary.body, incidents.body)
+        self.status_built_on = today
+
+    @refresh_status.before_loop
+    async def before_refresh_status(self):
+        await self.bot.wait_until_ready()
+
     @commands.command(aliases=["av"])
     async def avatar(self, ctx: CustomContext, *, member: discord.Member = None):
         """
@@ -92,45 +244,17 @@ class Info(commands.Cog):
         **Flags:**
         `-h|--history` - If this flag is provided, historical data will be shown instead.
         """
-        async with ctx.typing():
-            if "-h" in flags or "--history" in flags:
-                async with ctx.bot.session.get("https://srhpyqt94yxb.statuspage.io/api/v2/incidents.json") as r:
-                    incidents = (await r.json())["incidents"]
-                return await menus.MenuPages(utils.HistorySource(incidents, per_page=1), clear_reactions_after=True).start(ctx)
-
-            async with ctx.bot.session.get("https://srhpyqt94yxb.statuspage.io/api/v2/summary.json") as r:
-                summary = await r.json()
-
-            # embed 1
-            embed1 = discord.Embed(
-                title="Discord Status\nCurrent Status for Discord",
-                description="```yaml\n"
-                            f"Message: {summary['status']['description']}\n"
-                            f"Impact: {summary['status']['indicator'].title()}\n"
-                            "```",
-                colour=ctx.bot.embed_colour
-            )
-
-            # embed 2
-            embed2 = discord.Embed(title="Discord Status\nCurrent Incidents", colour=ctx.bot.embed_colour)
-            if not summary["incidents"]:
-                embed2.description = "```yaml\nThere are no issues with discord as of yet.```"
-            else:
-                embed2.description = "```yaml\n" + "\n\n".join(
-                    f"Name: {incident.get('name', None)}\n"
-                    f"Message: {incident.get('message', None)}\n"
-                    f"Status: {incident.get('status', None).title()}\n"
-                    f"Impact: {incident.get('impact', None).title()}" for incident in summary["incidents"]
-                ) + "```"
-
-            # embed 3
-            components = {c["name"]: c["status"].title().replace("_", " ") for c in summary["components"]}
-            embed3 = discord.Embed(
-                title="Discord Status\nComponents",
-                description=f"```yaml\n{utils.padding(components, separator=': ')}```",
-                colour=ctx.bot.embed_colour)
-
-            await menus.MenuPages(utils.DiscordStatusSource([embed1, embed2, embed3], per_page=1), clear_reactions_after=True).start(ctx)
+        if self.status_embeds is None:  # the first poll hasn't finished yet
+            async with ctx.typing():
+                await self.refresh_status()
+            if self.status_embeds is None:
+                return await ctx.send("Couldn't reach discord's status page. Try again later.")
+
+        if "-h" in flags or "--history" in flags:
+            embeds = self.history_embeds
+        else:
+            embeds = self.status_embeds
+        await menus.MenuPages(utils.DiscordStatusSource(embeds, per_page=1), clear_reactions_after=True).start(ctx)
 
     @commands.guild_only()
     @commands.command(aliases=["perms"])
@@ -161,12 +285,10 @@ class Info(commands.Cog):
         `word` - The word to search up.
         """
         async with ctx.typing():
-            url = f"https://api.dictionaryapi.dev/api/v2/entries/en/{word}"
-            async with ctx.bot.session.get(url) as r:
-                response = await r.json()
-            if isinstance(response, dict):
+            data = await self.definitions.get(word)
+            if data is None:
                 return await ctx.send("Sorry pal, I couldn't find definitions for the word you were looking for.")
-            await menus.MenuPages(utils.DefineSource(response[0]["meanings"], response[0]), clear_reactions_after=True).start(ctx)
+            await menus.MenuPages(utils.DefineSource(data["meanings"], data), clear_reactions_after=True).start(ctx)
 
     @commands.command(aliases=["ui"])
     async def userinfo(self, ctx: CustomContext, *, member: discord.Member = None):
@@ -224,4 +346,4 @@ class Info(commands.Cog):
 
 
 def setup(bot):
-    bot.add_cog(Info())
+    bot.add_cog(Info(bot))
@@ -6,78 +6,194 @@ import numpy as np
 import datetime
 import typing
 import textwrap
+import hashlib
+import re
+import asyncio
+import difflib
 
-from discord.ext import commands, menus
+from discord.ext import commands, menus, tasks
+from collections import OrderedDict, Counter, defaultdict
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, PB_Bot
+from utils.web import CircuitOpen, UpstreamUnavailable, ByteBudget, stream_text
 from config import config
 
-MAX_FILESIZE = 100_000
+MAX_PASTE_SIZE = 8_000_000  # bytes, across all attachments
 TODO_TASK_LENGTH = 200
 TODO_LIST_LENGTH = 100
+XKCD_LATEST_TTL = 600
+XKCD_SYNC_CONCURRENCY = 8
+XKCD_SYNC_BATCH = 100
+OCR_CACHE_SIZE = 256
+OCR_SOURCE_DPI = 96  # most attachments are screenshots
+OCR_TARGET_DPI = 300  # what tesseract is trained on
+OCR_MAX_SIDE = 2500
 pytesseract.pytesseract.tesseract_cmd = config["tesseract_path"]
 
 
+class XkcdIndex:
+    """
+    Local copy of xkcd's comic metadata, persisted in postgresql, with a token index over the titles.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.comics = {}
+        self.titles = {}
+        self.tokens = defaultdict(set)
+        self.synced = False  # set once a sync has completed, until then the index may only hold a few comics
+
+    @staticmethod
+    def tokenize(text: str):
+        return re.findall(r"\w+", text.lower())
+
+    def add(self, comic: dict):
+        num = comic["num"]
+        self.comics[num] = comic
+        self.titles[" ".join(self.tokenize(comic["safe_title"]))] = num
+        for token in self.tokenize(comic["safe_title"]):
+            self.tokens[token].add(num)
+
+    @staticmethod
+    def record(data: dict):
+        return {"num": data["num"], "safe_title": data["safe_title"], "alt": data["alt"], "img": data["img"],
+                "year": int(data["year"]), "month": int(data["month"]), "day": int(data["day"])}
+
+    async def store(self, comics: list):
+        await self.bot.pool.executemany(
+            "INSERT INTO xkcd_comics VALUES ($1, $2, $3, $4, $5, $6, $7) ON CONFLICT DO NOTHING",
+            [tuple(comic.values()) for comic in comics])
+        for comic in comics:
+            self.add(comic)
+
+    async def load(self):
+        for entry in await self.bot.pool.fetch("SELECT * FROM xkcd_comics"):
+            self.add(dict(entry))
+
+    async def fetch(self, num: int):
+        async with self.bot.session.get(f"https://xkcd.com/{num}/info.0.json") as r:
+            if r.status != 200:
+                return None
+            return self.record(await r.json())
+
+    async def sync(self):
+        """
+        Fetches any comics that aren't in the index yet.
+        """
+        latest = (await self.bot.http_cache.get("https://xkcd.com/info.0.json", ttl=XKCD_LATEST_TTL)).json()
+        missing = [num for num in range(1, latest["num"] + 1) if num not in self.comics and num != 404]  # :)
+        semaphore = asyncio.Semaphore(XKCD_SYNC_CONCURRENCY)
+
+        async def fetch(num: int):
+            async with semaphore:
+                return await self.fetch(num)
+
+        complete = True
+        for i in range(0, len(missing), XKCD_SYNC_BATCH):
+            comics = await asyncio.gather(*[fetch(num) for num in missing[i:i + XKCD_SYNC_BATCH]])
+            complete = complete and None not in comics
+            await self.store([comic for comic in comics if comic is not None])
+        if complete:  # otherwise the comics that failed to fetch are retried on the next sync
+            self.synced = True
+
+    def search(self, query: str):
+        """
+        Returns the number of the comic whose title best matches the query, or `None`.
+        """
+        tokens = self.tokenize(query)
+        if not tokens:
+            return None
+        if (num := self.titles.get(" ".join(tokens))) is not None:
+            return num
+
+        scores = Counter()
+        for token in tokens:
+            if token in self.tokens:
+                matches = [(token, 1.0)]
+            else:  # typos
+                matches = [(close, difflib.SequenceMatcher(None, token, close).ratio())
+                           for close in difflib.get_close_matches(token, self.tokens.keys(), n=3, cutoff=0.75)]
+            for match, weight in matches:
+                for num in self.tokens[match]:
+                    scores[num] += weight
+        if not scores:
+            return None
+        # prefer the most matching tokens, then the shortest title (fewest unmatched words)
+        return max(scores, key=lambda n: (scores[n], -len(self.tokenize(self.comics[n]["safe_title"]))))
+
+
 class Meta(commands.Cog):
     """
     Commands that don't belong to any specific category.
     """
-    @commands.command()
-    async def mystbin(self, ctx: CustomContext, *, text: str = None):
-        """
-        Paste text or a text file to https://mystb.in.
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.ocr_cache = OrderedDict()
+        self.xkcd_index = XkcdIndex(bot)
+        self.sync_xkcd.start()
 
-        `text` - The text to paste to mystbin.
+    def cog_unload(self):
+        self.sync_xkcd.cancel()
+
+    @tasks.loop(hours=1)
+    async def sync_xkcd(self):
+        try:
+            await self.xkcd_index.sync()
+        except (CircuitOpen, UpstreamUnavailable):
+            pass  # try again next time
+
+    @sync_xkcd.before_loop
+    async def before_sync_xkcd(self):
+        await self.bot.wait_until_ready()
+        await self.xkcd_index.load()
+
+    @staticmethod
+    async def stream_paste_input(ctx: CustomContext, text: str):
+        """
+        Yields the text and then the contents of each attachment as utf-8 encoded chunks, straight off the network.
         """
+        if text:
+            yield text.encode("utf-8")
+        yield b"\n\nATTACHMENTS\n\n"
+        budget = ByteBudget(MAX_PASTE_SIZE)  # counts the bytes downloaded, not the re-encoded text
+        for attachment in ctx.message.attachments:
+            async for chunk in stream_text(ctx.bot.session, attachment.url, limit=budget):
+                yield chunk.encode("utf-8")
+
+    async def paste(self, ctx: CustomContext, text: str, *, prefer: str):
         if not text and not ctx.message.attachments:
             return await ctx.send("No text or text file provided.")
-        data = []
-        if text:
-            data.append(text)
-        if ctx.message.attachments:
-            data.append("\n\nATTACHMENTS\n\n")
-            for attachment in ctx.message.attachments:
-                if attachment.height or attachment.width:
-                    return await ctx.send("Only text files can be used.")
-                if attachment.size > MAX_FILESIZE:
-                    return await ctx.send(f"File is too large (>{MAX_FILESIZE}kb).")
-                data.append((await attachment.read()).decode(encoding="utf-8"))
-        data = "".join(data)
+        if any(attachment.height or attachment.width for attachment in ctx.message.attachments):
+            return await ctx.send("Only text files can be used.")
+        if sum(attachment.size for attachment in ctx.message.attachments) > MAX_PASTE_SIZE:
+            return await ctx.send(f"Files are too large (>{MAX_PASTE_SIZE // 1_000_000}mb in total).")
+
+        # attachments are streamed into the upload so that big log files never sit in memory all at once
+        data = self.stream_paste_input(ctx, text) if ctx.message.attachments else text
         embed = discord.Embed(
             title="Paste Successful!",
-            description=f"[Click here to view]({await ctx.bot.mystbin(data)})",
+            description=f"[Click here to view]({await ctx.bot.paste_service.paste(data, prefer=prefer)})",
             colour=ctx.bot.embed_colour,
             timestamp=ctx.message.created_at)
         await ctx.send(embed=embed)
 
+    @commands.command()
+    async def mystbin(self, ctx: CustomContext, *, text: str = None):
+        """
+        Paste text or a text file to https://mystb.in (or another paste service if mystbin is slow or down).
+
+        `text` - The text to paste to mystbin.
+        """
+        await self.paste(ctx, text, prefer="mystbin")
+
     @commands.command()
     async def hastebin(self, ctx: CustomContext, *, text: str = None):
         """
-        Paste text or a text file to https://hastebin.com.
+        Paste text or a text file to https://hastebin.com (or another paste service if hastebin is slow or down).
 
         `text` - The text to paste to hastebin.
         """
-        if not text and not ctx.message.attachments:
-            return await ctx.send("No text or text file provided.")
-        data = []
-        if text:
-            data.append(text)
-        if ctx.message.attachments:
-            data.append("\n\nATTACHMENTS\n\n")
-            for attachment in ctx.message.attachments:
-                if attachment.height or attachment.width:
-                    return await ctx.send("Only text files can be used.")
-                if attachment.size > MAX_FILESIZE:
-                    return await ctx.send(f"File is too large (>{MAX_FILESIZE}kb).")
-                data.append((await attachment.read()).decode(encoding="utf-8"))
-        data = "".join(data)
-        embed = discord.Embed(
-            title="Paste Successful!",
-            description=f"[Click here to view]({await ctx.bot.hastebin(data)})",
-            colour=ctx.bot.embed_colour,
-            timestamp=ctx.message.created_at)
-        await ctx.send(embed=embed)
+        await self.paste(ctx, text, prefer="hastebin")
 
     @commands.command()
     async def xkcd(self, ctx: CustomContext, query: typing.Union[int, str] = None):
@@ -86,53 +202,115 @@ class Meta(commands.Cog):
 
         `query` - The comic to search for. Defaults to a random number.
         """
+        index = self.xkcd_index
         async with ctx.typing():
             if isinstance(query, str):
-                async with ctx.bot.session.get(
+                if index.synced:
+                    if (num := index.search(query)) is None:
+                        return await ctx.send("Couldn't find a comic with that query.")
+                else:  # the index hasn't been fully synced yet
+                    r = (await ctx.bot.http_cache.get(
                         "https://www.explainxkcd.com/wiki/api.php",
                         params={"action": "query", "list": "search", "format": "json", "srsearch": query,
-                                "srwhat": "title", "srlimit": "max"}) as resp:
-                    r = await resp.json()
+                                "srwhat": "title", "srlimit": "max"})).json()
                     if result := r["query"]["search"]:
-                        num = result[0]["title"].split(":")[0]
+                        num = int(result[0]["title"].split(":")[0])
                     else:
                         return await ctx.send("Couldn't find a comic with that query.")
             elif isinstance(query, int):
                 num = query
             else:
-                async with ctx.bot.session.get("https://xkcd.com/info.0.json") as resp:
-                    max_num = (await resp.json())["num"]
-                num = random.randint(1, max_num)
+                if index.synced:
+                    num = random.choice(list(index.comics))
+                else:
+                    max_num = (await ctx.bot.http_cache.get("https://xkcd.com/info.0.json", ttl=XKCD_LATEST_TTL)).json()["num"]
+                    num = random.randint(1, max_num)
 
-            async with ctx.bot.session.get(f"https://xkcd.com/{num}/info.0.json") as resp:
+            if (comic := index.comics.get(num)) is None:
+                resp = await ctx.bot.http_cache.get(f"https://xkcd.com/{num}/info.0.json")
                 if resp.status in range(400, 500):
                     return await ctx.send("Couldn't find a comic with that number.")
                 elif resp.status >= 500:
                     return await ctx.send("Server error.")
-                data = await resp.json()
+                comic = index.record(resp.json())
+                await index.store([comic])
 
             embed = discord.Embed(
-                title=f"{data['safe_title']} (Comic Number `{data['num']}`)",
-                description=data["alt"],
-                timestamp=datetime.datetime(year=int(data["year"]), month=int(data["month"]), day=int(data["day"])),
+                title=f"{comic['safe_title']} (Comic Number `{comic['num']}`)",
+                description=comic["alt"],
+                timestamp=datetime.datetime(year=comic["year"], month=comic["month"], day=comic["day"]),
                 colour=ctx.bot.embed_colour)
-            embed.set_image(url=data["img"])
+            embed.set_image(url=comic["img"])
             embed.set_footer(text="Created:")
             await ctx.send(embed=embed)
 
-    def _ocr(self, bytes_):
-        img = cv2.imdecode(np.fromstring(bytes_, np.uint8), 1)
-        return pytesseract.image_to_string(img)
+    @staticmethod
+    def _preprocess(img, *, deskew: bool = False):
+        """
+        Prepares an image for tesseract: grayscale, rescale to ~300 DPI, adaptive threshold and optionally deskew.
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+        # rescale so that text is roughly the size tesseract expects, without blowing up huge screenshots
+        scale = min(OCR_TARGET_DPI / OCR_SOURCE_DPI, OCR_MAX_SIDE / max(gray.shape))
+        if scale != 1:
+            interpolation = cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
 
-    @commands.command()
-    async def ocr(self, ctx: CustomContext):
+        # tesseract prefers dark text on a light background (dark mode screenshots are the opposite)
+        if gray.mean() < 127:
+            gray = cv2.bitwise_not(gray)
+
+        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+        if deskew:
+            coords = cv2.findNonZero(cv2.bitwise_not(binary))
+            if coords is not None:
+                angle = cv2.minAreaRect(coords)[-1]
+                if angle > 45:
+                    angle -= 90
+                elif angle < -45:
+                    angle += 90
+                if abs(angle) > 0.5:
+                    h, w = binary.shape
+                    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+                    binary = cv2.warpAffine(binary, matrix, (w, h), flags=cv2.INTER_CUBIC,
+                                            borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+        return binary
+
+    def _ocr(self, bytes_, deskew: bool = False):
+        """
+        Returns the text in an image, or `None` if the bytes aren't an image.
+        """
+        img = cv2.imdecode(np.frombuffer(bytes_, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        return pytesseract.image_to_string(self._preprocess(img, deskew=deskew))
+
+    @commands.command(usage="[--deskew]")
+    async def ocr(self, ctx: CustomContext, *flags):
         """
         Read the contents of an attachment using `pytesseract`.
         **NOTE:** This can be *very* inaccurate at times.
+
+        **Flags:**
+        `--deskew` - If this flag is provided, the image will be straightened before being read.
         """
         if not ctx.message.attachments:
             return await ctx.send("No attachment provided.")
-        ocr_result = await ctx.bot.loop.run_in_executor(None, self._ocr, await ctx.message.attachments[0].read())
+        deskew = "--deskew" in flags
+        bytes_ = await ctx.message.attachments[0].read()
+
+        key = (hashlib.sha256(bytes_).hexdigest(), deskew)
+        if (ocr_result := self.ocr_cache.get(key)) is not None:
+            self.ocr_cache.move_to_end(key)
+        else:
+            ocr_result = await ctx.bot.loop.run_in_executor(None, self._ocr, bytes_, deskew)
+            if ocr_result is None:
+                return await ctx.send("That attachment isn't an image.")
+            self.ocr_cache[key] = ocr_result
+            if len(self.ocr_cache) > OCR_CACHE_SIZE:
+                self.ocr_cache.popitem(last=False)
         await ctx.send(f"Text to image result for **{ctx.author}**\n```{ocr_result}```")
 
     @commands.command()
@@ -211,4 +389,4 @@ class Meta(commands.Cog):
 
 
 def setup(bot):
-    bot.add_cog(Meta())
+    bot.add_cog(Meta(bot))
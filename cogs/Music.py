@@ -3,29 +3,255 @@ import wavelink
 import humanize
 import datetime
 import random
-
-from discord.ext import commands, menus
+import json
+import itertools
+import asyncio
+import zlib
+import time
+import logging
+
+from discord.ext import commands, menus, tasks
 from contextlib import suppress
+from collections import Counter, OrderedDict, defaultdict, deque
 from typing import Union
 
 from utils import utils
 from utils.classes import PB_Bot, CustomContext
 from config import config
 
+log = logging.getLogger(__name__)
+
 DEFAULT_VOLUME = 40
 QUEUE_LIMIT = 100
+HISTORY_LIMIT = 500
+NODE_CHECK_INTERVAL = 15
+SNAPSHOT_DELAY = 2  # debounces snapshots when several things change at once
+SNAPSHOT_INTERVAL = 30  # keeps the saved position fresh
+SNAPSHOT_EXPIRE = 86400
+IDLE_TIMEOUT = config.get("player_idle_timeout", 300)
+REAP_INTERVAL = 60
+TRACK_CACHE_TTL = 7 * 86400
+GAP_SAMPLES = 1000
+
+
+class Track:
+    """
+    Compact track record for queued songs. Converted into a `wavelink.Track` only when it's played.
+    """
+    __slots__ = ("id", "identifier", "title", "length", "uri", "requester_id")
+
+    def __init__(self, id_: str, identifier: str, title: str, length: int, uri: str, requester_id: int):
+        self.id = id_  # the encoded track lavalink plays from
+        self.identifier = identifier
+        self.title = title
+        self.length = length
+        self.uri = uri
+        self.requester_id = requester_id
 
+    def __str__(self):
+        return self.title
 
-class Track(wavelink.Track):
+    @classmethod
+    def from_wavelink(cls, track: wavelink.Track, requester_id: int):
+        return cls(track.id, track.identifier, track.title, track.length, track.uri, requester_id)
+
+    def to_wavelink(self):
+        info = {"identifier": self.identifier, "title": self.title, "length": self.length, "uri": self.uri}
+        return wavelink.Track(self.id, info)
+
+
+def encode_track(track: Track):
     """
-    Custom track object with a requester attribute.
+    Encodes a track as a compact list for player snapshots.
     """
-    __slots__ = ("requester",)
+    return [track.id, track.title, track.length, track.uri, track.identifier, track.requester_id]
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args)
 
-        self.requester = kwargs.get("requester")
+def decode_track(data: list):
+    id_, title, length, uri, identifier, requester_id = data
+    return Track(id_, identifier, title, length, uri, requester_id)
+
+
+def normalize_title(title: str):
+    return " ".join(title.lower().split())
+
+
+class SongQueue:
+    """
+    Song queue with O(1) appends and pops, a history for `previous` and an index of the upcoming songs by
+    track identifier and normalized title.
+
+    The history keeps the last `HISTORY_LIMIT` songs, or every song while the queue is looping so that the whole
+    loop gets replayed.
+    """
+    def __init__(self):
+        self.upcoming = OrderedDict()  # entry_id: track
+        self.history = deque()
+        self.current = None
+        self.loop = False
+
+        self.by_identifier = defaultdict(set)  # identifier: {entry_id, ...}
+        self.by_title = defaultdict(set)  # normalized title: {entry_id, ...}
+        self._entry_ids = itertools.count()
+
+    def __len__(self):
+        return len(self.upcoming)
+
+    @property
+    def offset(self):
+        """
+        How many songs `songqueue` lists before the upcoming ones (the history and the current song).
+        """
+        return len(self.history) + (self.current is not None)
+
+    def __iter__(self):
+        return iter(self.upcoming.values())
+
+    # indexing
+
+    def _add(self, track, *, front: bool = False):
+        entry_id = next(self._entry_ids)
+        self.upcoming[entry_id] = track
+        if front:
+            self.upcoming.move_to_end(entry_id, last=False)
+        self.by_identifier[track.identifier].add(entry_id)
+        self.by_title[normalize_title(track.title)].add(entry_id)
+
+    def _discard(self, entry_id: int):
+        track = self.upcoming.pop(entry_id)
+        for index, key in ((self.by_identifier, track.identifier), (self.by_title, normalize_title(track.title))):
+            index[key].discard(entry_id)
+            if not index[key]:
+                del index[key]
+        return track
+
+    # playback
+
+    def append(self, track):
+        self._add(track)
+
+    def extend(self, tracks):
+        for track in tracks:
+            self._add(track)
+
+    def peek(self):
+        """
+        Returns the next song without removing it, or `None` if the queue is empty.
+        """
+        return next(iter(self.upcoming.values()), None)
+
+    def pop(self):
+        """
+        Moves the current song into the history and makes the next song current. Returns `None` if the queue is empty.
+        """
+        if not self.upcoming:
+            return None
+        if self.current is not None:
+            self.history.append(self.current)
+            while not self.loop and len(self.history) > HISTORY_LIMIT:
+                self.history.popleft()
+        self.current = self._discard(next(iter(self.upcoming)))
+        return self.current
+
+    def rewind(self):
+        """
+        Puts the current and previous songs back at the front of the queue, so that the next `pop` returns the previous song.
+        """
+        if not self.history:
+            return False
+        if self.current is not None:
+            self._add(self.current, front=True)
+        self._add(self.history.pop(), front=True)
+        self.current = None
+        return True
+
+    def restart(self):
+        """
+        Requeues the history and the current song, used for looping.
+        """
+        played = list(self.history)
+        if self.current is not None:
+            played.append(self.current)
+        self.history.clear()
+        self.current = None
+        self.extend(played)
+
+    def shuffle(self):
+        entries = list(self.upcoming.items())
+        random.shuffle(entries)
+        self.upcoming = OrderedDict(entries)
+
+    # removal
+
+    def remove_at(self, position: int):
+        """
+        Removes the upcoming song at `position`, starting from 1. Positions aren't indexed, so this walks the queue
+        from whichever end is closer, which is at most `QUEUE_LIMIT // 2` steps.
+        """
+        if not 0 < position <= len(self.upcoming):
+            return None
+        if position <= len(self.upcoming) // 2:
+            entry_id = next(itertools.islice(self.upcoming, position - 1, None))
+        else:
+            entry_id = next(itertools.islice(reversed(self.upcoming), len(self.upcoming) - position, None))
+        return self._discard(entry_id)
+
+    def remove_identifier(self, identifier: str):
+        return [self._discard(entry_id) for entry_id in self.by_identifier.get(identifier, set()).copy()]
+
+    def remove_title(self, title: str):
+        return [self._discard(entry_id) for entry_id in self.by_title.get(normalize_title(title), set()).copy()]
+
+    def remove(self, query: str):
+        """
+        Removes songs by position, track identifier or title, in that order. Falls back to a partial title match.
+
+        Positions are numbered like `songqueue` lists them, so the history and the current song come first and only
+        positions of upcoming songs can be removed. Other numbers are looked up as titles, so songs like "1999" can
+        still be removed by name.
+        """
+        if query.isdigit() and (track := self.remove_at(int(query) - self.offset)):
+            return [track]
+        if removed := self.remove_identifier(query) or self.remove_title(query):
+            return removed
+        query = normalize_title(query)
+        for title in self.by_title:
+            if query in title:
+                return self.remove_title(title)
+        return []
+
+
+class TrackSearchCache:
+    """
+    Caches the top search result for a query in redis, so that popular songs don't need a lavalink search.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.stats = defaultdict(Counter)  # guild_id: {"hits": x, "misses": y}
+
+    @property
+    def totals(self):
+        totals = Counter()
+        for counter in self.stats.values():
+            totals.update(counter)
+        return totals
+
+    async def search(self, query: str, *, guild_id: int):
+        """
+        Same as `wavelink.Client.get_tracks(f"ytsearch:{query}")`, except that a cache hit only returns the top result.
+        """
+        key = f"tracks:{normalize_title(query)}"
+        if (cached := await self.bot.redis.get(key, encoding="utf-8")) is not None:
+            self.stats[guild_id]["hits"] += 1
+            data = json.loads(cached)
+            return [wavelink.Track(data["id"], data["info"])]
+
+        self.stats[guild_id]["misses"] += 1
+        query_results = await self.bot.wavelink.get_tracks(f"ytsearch:{query}")
+        if query_results and not isinstance(query_results, wavelink.TrackPlaylist):
+            track = query_results[0]
+            await self.bot.redis.set(key, json.dumps({"id": track.id, "info": track.info}), expire=TRACK_CACHE_TTL)
+        return query_results
 
 
 class Player(wavelink.Player):
@@ -43,13 +269,35 @@ class Player(wavelink.Player):
         self.is_locked = False
         self.dj = None
 
+        self.queue = SongQueue()
         self.repeat = False
         self.loop = False
 
-        self.queue = []
         self.menus = []
         self.volume = DEFAULT_VOLUME
-        self.queue_position = 0
+        self.snapshot_task = None
+
+        self.now_playing_task = None
+        self.ended_at = None  # time.perf_counter() the last track ended, for measuring the gap between songs
+
+        self.last_active = time.monotonic()
+        self.alone_since = None
+
+    @property
+    def loop(self):
+        return self.queue.loop
+
+    @loop.setter
+    def loop(self, value: bool):
+        self.queue.loop = value
+
+    def enqueue(self, tracks: list, requester: discord.Member):
+        """
+        Adds tracks to the queue without going over the queue limit. Returns how many were added and how many were truncated.
+        """
+        space = max(QUEUE_LIMIT - len(self.queue), 0)
+        self.queue.extend(Track.from_wavelink(track, requester.id) for track in itertools.islice(tracks, space))
+        return min(len(tracks), space), max(len(tracks) - space, 0)
 
     async def start(self, ctx: CustomContext, song: Union[wavelink.TrackPlaylist, list]):
         # connect to voice
@@ -60,15 +308,12 @@ class Player(wavelink.Player):
         await self.connect(voice_channel.id)
 
         # add the first song
-        if isinstance(song, wavelink.TrackPlaylist):
-            for track in song.tracks:
-                track = Track(track.id, track.info, requester=ctx.author)
-                self.queue.append(track)
-            now_playing = song.tracks[0]
-        else:
-            track = Track(song[0].id, song[0].info, requester=ctx.author)
-            self.queue.append(track)
-            now_playing = track
+        # the first song is played straight away, so it doesn't count towards the queue limit
+        tracks = song.tracks[:QUEUE_LIMIT + 1] if isinstance(song, wavelink.TrackPlaylist) else song[:1]
+        now_playing = Track.from_wavelink(tracks[0], ctx.author.id)
+        self.queue.current = now_playing
+        _, truncated = self.enqueue(tracks[1:], ctx.author)
+        truncated += len(song.tracks) - len(tracks) if isinstance(song, wavelink.TrackPlaylist) else 0
 
         # embed
         duration = datetime.timedelta(milliseconds=now_playing.length)
@@ -82,10 +327,11 @@ class Player(wavelink.Player):
                         f"**YT Link:** [Click Here!]({now_playing.uri})\n",
             timestamp=datetime.datetime.now(),
             colour=ctx.bot.embed_colour)
+        if truncated:
+            embed.set_footer(text=f"{truncated} songs weren't added because only {QUEUE_LIMIT} songs can be in the queue at a time.")
         await ctx.send(embed=embed)
 
         # start playing
-        self.queue_position += 1
         await self.play(now_playing)
 
         # finalise
@@ -93,43 +339,155 @@ class Player(wavelink.Player):
         self.dj = ctx.author.id
         self.session_started = True
 
-    async def do_next(self):
+    async def play(self, track, **kwargs):
+        """
+        Converts compact tracks into wavelink tracks before playing them.
+        """
+        await super().play(track.to_wavelink() if isinstance(track, Track) else track, **kwargs)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def idle_reason(self):
+        """
+        Returns why the player should be destroyed, or `None` if it's still in use.
+        """
+        now = time.monotonic()
+        if self.alone_since is not None and now - self.alone_since > IDLE_TIMEOUT:
+            return "empty channel"
+        if (not self.is_playing or self.is_paused) and now - self.last_active > IDLE_TIMEOUT:
+            return "idle"
+        return None
+
+    def build_now_playing(self):
+        """
+        Renders the now playing message, which the edit scheduler keeps up to date.
+        """
+        if (song := self.queue.current) is None:
+            return None
+        position = self.position if self.current is not None and self.current.id == song.id else 0
+        embed = discord.Embed(title="Now Playing:", colour=self.bot.embed_colour,
+                              description=f"{song}\n{utils.progress_bar(position, song.length, self.bot.emoji_dict)}")
+        embed.set_footer(text=f"Requested by {self.bot.get_user(song.requester_id) or 'someone who has left'}")
+        return {"embed": embed}
+
+    async def delete_now_playing(self):
+        message, self.now_playing = self.now_playing, None
+        self.bot.edit_scheduler.unregister(message)
         with suppress((discord.Forbidden, discord.HTTPException, AttributeError)):
-            await self.now_playing.delete()
+            await message.delete()
 
-        if self.repeat:
-            self.queue_position -= 1
+    async def replace_now_playing(self, previous: asyncio.Task = None):
+        if previous is not None:
+            await asyncio.wait([previous])  # keeps the messages in order when songs end in quick succession
+        await asyncio.gather(self.delete_now_playing(), self.send_now_playing())
 
-        try:
-            song = self.queue[self.queue_position]
-        except IndexError:  # There are no more songs in the queue.
-            if self.loop:
-                self.queue_position = 0
-                song = self.queue[self.queue_position]
-            else:
+    async def send_now_playing(self):
+        if (render := self.build_now_playing()) is None:
+            return
+        self.now_playing = await self.session_chan.send(**render)
+        self.bot.edit_scheduler.register(self.now_playing, self.build_now_playing)
+
+    async def do_next(self):
+        if self.repeat and self.queue.current is not None:
+            song = self.queue.current
+        else:
+            song = self.queue.pop()
+            if song is None and self.loop:  # There are no more songs in the queue.
+                self.queue.restart()
+                song = self.queue.pop()
+            if song is None:
                 await self.destroy()
                 return
 
-        self.queue_position += 1
-
-        embed = discord.Embed(title="Now Playing:", description=f"{song}", colour=self.bot.embed_colour)
-        embed.set_footer(text=f"Requested by {song.requester}")
-        self.now_playing = await self.session_chan.send(embed=embed)
+        # start the next song before touching any messages, so that the discord api isn't in the gap between songs
         await self.play(song)
+        self.touch()
+        self.schedule_snapshot()
+        self.now_playing_task = self.bot.loop.create_task(self.replace_now_playing(self.now_playing_task))
 
     async def do_previous(self):
-        self.queue_position -= 2
-        await self.stop()
+        if self.queue.rewind():
+            await self.stop()
 
-    async def destroy(self):
-        with suppress((discord.Forbidden, discord.HTTPException, AttributeError)):
-            await self.now_playing.delete()
+    # persistence
+
+    @property
+    def snapshot_key(self):
+        return f"player:{self.guild_id}"
+
+    def to_snapshot(self):
+        """
+        Returns the player state as zlib compressed json.
+        """
+        state = {
+            "channel": self.channel_id,
+            "session_chan": self.session_chan.id if self.session_chan is not None else None,
+            "dj": self.dj,
+            "locked": self.is_locked,
+            "repeat": self.repeat,
+            "loop": self.loop,
+            "volume": self.volume,
+            "paused": self.is_paused,
+            "position": int(self.position),
+            "current": encode_track(self.queue.current),
+            "upcoming": [encode_track(track) for track in self.queue],
+            "history": [encode_track(track) for track in self.queue.history]
+        }
+        return zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+
+    async def snapshot(self):
+        if not self.session_started or self.queue.current is None:
+            return
+        await self.bot.redis.set(self.snapshot_key, self.to_snapshot(), expire=SNAPSHOT_EXPIRE)
+
+    def schedule_snapshot(self):
+        if self.snapshot_task is None or self.snapshot_task.done():
+            self.snapshot_task = self.bot.loop.create_task(self.snapshot_later())
+
+    async def snapshot_later(self):
+        await asyncio.sleep(SNAPSHOT_DELAY)
+        await self.snapshot()
+
+    async def restore(self, snapshot: bytes):
+        """
+        Restores the player from a snapshot and resumes playing at the saved position.
+        """
+        state = json.loads(zlib.decompress(snapshot))
+        guild = self.bot.get_guild(self.guild_id)
+        if (session_chan := guild.get_channel(state["session_chan"] or 0)) is None:
+            raise ValueError(f"The session channel of player {self.guild_id} no longer exists.")
+
+        self.queue.history.extend(decode_track(track) for track in state["history"])
+        self.queue.extend(decode_track(track) for track in state["upcoming"])
+        self.queue.current = decode_track(state["current"])
+
+        self.session_chan = session_chan
+        self.dj = state["dj"]
+        self.is_locked = state["locked"]
+        self.repeat = state["repeat"]
+        self.loop = state["loop"]
+        self.session_started = True
+
+        await self.connect(state["channel"])
+        await self.set_volume(state["volume"])
+        await self.play(self.queue.current, start=state["position"])
+        if state["paused"]:
+            await self.set_pause(True)
+
+    async def destroy(self, *, force: bool = False):
+        for task in (self.snapshot_task, self.now_playing_task):
+            if task is not None:
+                task.cancel()
+        await self.bot.redis.delete(self.snapshot_key)
+
+        await self.delete_now_playing()
 
         menus_ = self.menus.copy()
         for menu in menus_:
             menu.stop()
 
-        await super().destroy()
+        await super().destroy(force=force)
 
 
 # def dj_check():
@@ -190,9 +548,21 @@ class Music(commands.Cog):
     Music commands.
     """
     def __init__(self, bot: PB_Bot):
-        CustomContext.player = property(lambda ctx: bot.wavelink.get_player(ctx.guild.id, cls=Player))
+        CustomContext.player = property(lambda ctx: self.get_player(ctx.guild.id))
         self.bot = bot
+        self.track_cache = TrackSearchCache(bot)
+        self.migrations = Counter()  # node identifier: players moved off it
         bot.loop.create_task(self.start_nodes())
+        self.check_nodes.start()
+        self.snapshot_players.start()
+        self.reaped = Counter()  # reason: players destroyed
+        self.gaps = deque(maxlen=GAP_SAMPLES)  # seconds between a track ending and the next one starting
+        self.reap_players.start()
+
+    def cog_unload(self):
+        self.check_nodes.cancel()
+        self.snapshot_players.cancel()
+        self.reap_players.cancel()
 
     async def cog_check(self, ctx: CustomContext):
         if not ctx.guild:
@@ -210,6 +580,14 @@ class Music(commands.Cog):
             return False
         return True
 
+    async def cog_after_invoke(self, ctx: CustomContext):
+        if (player := ctx.bot.wavelink.players.get(ctx.guild.id)) is not None:
+            player.touch()
+            if player.session_started:
+                player.schedule_snapshot()
+
+    # nodes
+
     async def start_nodes(self):
         await self.bot.wait_until_ready()
 
@@ -218,20 +596,162 @@ class Music(commands.Cog):
             for node in previous_nodes.values():
                 await node.destroy()
 
-        node = await self.bot.wavelink.initiate_node(**config["wavelink_node"])
-        node.set_hook(self.on_node_event)
+        # one unreachable node shouldn't stop the others from starting
+        node_configs = config.get("wavelink_nodes") or [config["wavelink_node"]]
+        nodes = await asyncio.gather(*[self.bot.wavelink.initiate_node(**node_config) for node_config in node_configs],
+                                     return_exceptions=True)
+        for node_config, node in zip(node_configs, nodes):
+            if isinstance(node, wavelink.Node):
+                node.set_hook(self.on_node_event)
+            elif isinstance(node, Exception):
+                log.error("Starting lavalink node %s (%s:%s) failed", node_config.get("identifier"),
+                          node_config.get("host"), node_config.get("port"), exc_info=node)
+
+        await self.restore_players()
+
+    def best_node(self):
+        """
+        Returns the available node with the lowest penalty (based on its cpu load, frame deficit and player count).
+        """
+        nodes = [node for node in self.bot.wavelink.nodes.values() if node.is_available]
+        return min(nodes, key=lambda node: node.penalty, default=None)
+
+    def get_player(self, guild_id: int) -> Player:
+        with suppress(KeyError):
+            return self.bot.wavelink.players[guild_id]
+        node = self.best_node()
+        return self.bot.wavelink.get_player(guild_id, cls=Player, node_id=node.identifier if node else None)
+
+    @tasks.loop(seconds=NODE_CHECK_INTERVAL)
+    async def check_nodes(self):
+        try:
+            await self.migrate_players()
+        except Exception:  # an unexpected error would otherwise stop the health checks for good
+            log.exception("Checking lavalink nodes failed")
+
+    async def migrate_players(self):
+        """
+        Moves players off of nodes that have gone down.
+        """
+        for node in list(self.bot.wavelink.nodes.values()):
+            if node.is_available or not node.players:
+                continue
+            for player in list(node.players.values()):
+                if (best_node := self.best_node()) is None:
+                    return
+                try:
+                    await player.change_node(best_node.identifier)
+                except wavelink.WavelinkException:
+                    continue
+                except Exception:  # keep moving the other players
+                    log.exception("Moving player %s off of node %s failed", player.guild_id, node.identifier)
+                    continue
+                self.migrations[node.identifier] += 1
+
+    @check_nodes.before_loop
+    async def before_check_nodes(self):
+        await self.bot.wait_until_ready()
+
+    # persistence
+
+    @tasks.loop(seconds=SNAPSHOT_INTERVAL)
+    async def snapshot_players(self):
+        for player in list(self.bot.wavelink.players.values()):
+            if not player.is_playing:
+                continue
+            try:
+                await player.snapshot()
+            except Exception:  # keep snapshotting the other players
+                log.exception("Snapshotting player %s failed", player.guild_id)
+
+    @snapshot_players.before_loop
+    async def before_snapshot_players(self):
+        await self.bot.wait_until_ready()
+
+    # idle players
+
+    @tasks.loop(seconds=REAP_INTERVAL)
+    async def reap_players(self):
+        """
+        Destroys players that have been alone in their voice channel or idle for longer than `IDLE_TIMEOUT`.
+        """
+        for player in list(self.bot.wavelink.players.values()):
+            try:
+                await self.reap_player(player)
+            except Exception:  # keep reaping the other players
+                log.exception("Reaping player %s failed", player.guild_id)
+
+    async def reap_player(self, player: Player):
+        if (reason := player.idle_reason()) is None:
+            return
+        if player.session_chan is not None and player.is_connected:
+            with suppress(discord.HTTPException):
+                await player.session_chan.send(f"Left the voice channel because the player was inactive ({reason}).")
+        with suppress(wavelink.WavelinkException):
+            await player.destroy()
+        self.reaped[reason] += 1
+
+    @reap_players.before_loop
+    async def before_reap_players(self):
+        await self.bot.wait_until_ready()
+
+    async def restore_players(self):
+        """
+        Resumes every player that was playing when the bot last shut down, unless its voice channel is now empty.
+        """
+        async for key in self.bot.redis.iscan(match="player:*"):
+            try:
+                await self.restore_player(key)
+            except Exception:  # keep restoring the other players
+                log.exception("Restoring player from %s failed", key)
+
+    async def restore_player(self, key: bytes):
+        snapshot = await self.bot.redis.get(key)
+        guild = self.bot.get_guild(int(key.decode("utf-8").split(":")[1]))
+        if guild is None or snapshot is None or guild.id in self.bot.wavelink.players:
+            return
+        try:
+            state = json.loads(zlib.decompress(snapshot))
+            channel = guild.get_channel(state["channel"])
+            session_chan = guild.get_channel(state["session_chan"] or 0)
+        except (zlib.error, ValueError, KeyError, TypeError):  # a corrupt snapshot would fail on every restart
+            log.warning("Deleting unreadable player snapshot %s", key)
+            await self.bot.redis.delete(key)
+            return
+        if channel is None or session_chan is None or not any(not member.bot for member in channel.members):
+            await self.bot.redis.delete(key)
+            return
+        with suppress(wavelink.WavelinkException, discord.HTTPException):
+            await self.get_player(guild.id).restore(snapshot)
 
     async def on_node_event(self, event):
-        if isinstance(event, (wavelink.TrackEnd, wavelink.TrackException)):
+        # lavalink follows a TrackExceptionEvent with a TrackEndEvent, and a replaced track has already been
+        # followed by the track that replaced it, so only the other TrackEndEvents move the queue along
+        if isinstance(event, wavelink.TrackStart):
+            if event.player.ended_at is not None:
+                self.gaps.append(time.perf_counter() - event.player.ended_at)
+                event.player.ended_at = None
+        elif isinstance(event, wavelink.TrackEnd) and event.reason != "REPLACED":
+            event.player.ended_at = time.perf_counter()
             await event.player.do_next()
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
+        if (player := self.bot.wavelink.players.get(member.guild.id)) is None or before.channel == after.channel:
+            return
         if before.channel and not after.channel:  # the member was in a vc and the member left the vc
-            player = self.bot.wavelink.get_player(member.guild.id, cls=Player)
             if member.id == player.dj:
                 player.dj = None
 
+        # keep track of whether anyone is still listening
+        channel = member.guild.get_channel(player.channel_id) if player.channel_id else None
+        if channel is None:
+            return
+        if any(not member_.bot for member_ in channel.members):
+            player.alone_since = None
+        elif player.alone_since is None:
+            player.alone_since = time.monotonic()
+
     @commands.command()
     async def connect(self, ctx: CustomContext, *, voice_channel: discord.VoiceChannel = None):
         """
@@ -297,11 +817,11 @@ class Music(commands.Cog):
 
         `limit` - The amount of songs to get from the queue. Fetches all songs if this is not provided.
         """
-        if limit is None:
-            source = [(number, track) for number, track in enumerate(ctx.player.queue, start=1)]
-        else:
-            source = [(number, track) for number, track in enumerate(ctx.player.queue[:limit], start=1)]
-        await menus.MenuPages(utils.QueueSource(source, ctx.player)).start(ctx)
+        queue = ctx.player.queue
+        songs = itertools.chain(queue.history, [queue.current] if queue.current is not None else [], queue)
+        source = list(enumerate(itertools.islice(songs, limit), start=1))
+        current_number = queue.offset if queue.current is not None else None
+        await menus.MenuPages(utils.QueueSource(source, current_number)).start(ctx)
 
     @is_privileged()
     @songqueue.command()
@@ -315,20 +835,15 @@ class Music(commands.Cog):
     @songqueue.command()
     async def remove(self, ctx: CustomContext, *, query: str):
         """
-        Removes a song from the queue.
+        Removes songs from the queue.
 
-        `query` - The song to remove from the queue.
+        `query` - The position (as numbered in `songqueue`), track ID or title of the song to remove from the queue.
         """
-        query_results = await ctx.bot.wavelink.get_tracks(f"ytsearch:{query}")
-        if not query_results:
-            return await ctx.send(f"Could not find any songs with that query.")
-        track = Track(query_results[0].id, query_results[0].info, requester=ctx.author)
-        for track_, position in enumerate(ctx.player.queue):
-            if str(track_) == str(track):
-                ctx.player.queue.remove(track_)
-                if position < ctx.player.queue_position:
-                    ctx.player.queue_position -= 1
-        await ctx.send(f"Removed all songs with the name `{track}` from the queue. Queue length: `{len(ctx.player.queue)}`")
+        removed = ctx.player.queue.remove(query)
+        if not removed:
+            return await ctx.send(f"Could not find any songs in the queue with that query.")
+        await ctx.send(f"Removed `{len(removed)}` song(s) with the name `{removed[0]}` from the queue. "
+                       f"Queue length: `{len(ctx.player.queue)}`")
 
     @is_privileged()
     @commands.command()
@@ -341,7 +856,7 @@ class Music(commands.Cog):
         if len(ctx.player.queue) >= QUEUE_LIMIT:
             return await ctx.send(f"Sorry, only `{QUEUE_LIMIT}` songs can be in the queue at a time.")
 
-        query_results = await ctx.bot.wavelink.get_tracks(f"ytsearch:{query}")
+        query_results = await self.track_cache.search(query, guild_id=ctx.guild.id)
         if not query_results:
             return await ctx.send(f"Could not find any songs with that query.")
 
@@ -349,16 +864,15 @@ class Music(commands.Cog):
             return await ctx.player.start(ctx, query_results)
 
         if isinstance(query_results, wavelink.TrackPlaylist):
-            for track in query_results.tracks:
-                track = Track(track.id, track.info, requester=ctx.author)
-                ctx.player.queue.append(track)
+            added, truncated = ctx.player.enqueue(query_results.tracks, ctx.author)
             playlist_name = query_results.data['playlistInfo']['name']
-            await ctx.send(f"Added playlist `{playlist_name}` with `{len(query_results.tracks)}` songs to the queue. "
-                           f"Queue length: `{len(ctx.player.queue)}`")
+            message = f"Added playlist `{playlist_name}` with `{added}` songs to the queue. Queue length: `{len(ctx.player.queue)}`"
+            if truncated:
+                message += f"\n`{truncated}` songs weren't added because only `{QUEUE_LIMIT}` songs can be in the queue at a time."
+            await ctx.send(message)
         else:
-            track = Track(query_results[0].id, query_results[0].info, requester=ctx.author)
-            ctx.player.queue.append(track)
-            await ctx.send(f"Added `{track}` to the queue. Queue length: `{len(ctx.player.queue)}`")
+            ctx.player.enqueue(query_results[:1], ctx.author)
+            await ctx.send(f"Added `{query_results[0]}` to the queue. Queue length: `{len(ctx.player.queue)}`")
 
     @is_playing()
     @is_privileged()
@@ -455,7 +969,7 @@ class Music(commands.Cog):
         """
         Shuffles the queue.
         """
-        random.shuffle(ctx.player.queue)
+        ctx.player.queue.shuffle()
         with suppress(discord.HTTPException):
             await ctx.message.add_reaction("✅")
 
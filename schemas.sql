@@ -25,3 +25,20 @@ CREATE TABLE IF NOT EXISTS blacklisted_users (
     user_id bigint PRIMARY KEY,
     reason text
 );
+
+CREATE TABLE IF NOT EXISTS xkcd_comics (
+    num        int PRIMARY KEY,
+    safe_title text,
+    alt        text,
+    img        text,
+    year       int,
+    month      int,
+    day        int
+);
+
+CREATE TABLE IF NOT EXISTS pastes (
+    key        text PRIMARY KEY,
+    content    text,
+    created_at timestamp DEFAULT now(),
+    expires_at timestamp
+);
@@ -0,0 +1,112 @@
+"""
+Stress checks the request coalescing in `utils.web`: fires N concurrent identical requests through `SingleFlight`
+and `HTTPCache` against a counting fake upstream and asserts that only one upstream request is made.
+
+    python -m scripts.coalescing_check --callers 1000
+"""
+import argparse
+import asyncio
+
+from utils.web import HTTPCache, SingleFlight
+
+
+class FakeResponse:
+    def __init__(self, url: str):
+        self.url = url
+        self.status = 200
+        self.headers = {"Content-Type": "application/json"}
+
+    async def read(self):
+        return b'{"title": "Synthetic comic"}'
+
+
+class CountingSession:
+    """
+    Stands in for `aiohttp.ClientSession.get`, counting the requests that reach it. Each request takes `latency`
+    seconds, so that the concurrent callers overlap.
+    """
+    def __init__(self, *, latency: float):
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, url: str, **kwargs):
+        return ResponseContext(self.request(url))
+
+    async def request(self, url: str):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return FakeResponse(url)
+
+
+class ResponseContext:
+    def __init__(self, coro):
+        self.coro = coro
+        self.response = None
+
+    async def __aenter__(self):
+        self.response = await self.coro
+        return self.response
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+
+async def check_single_flight(callers: int, latency: float):
+    flights = SingleFlight()
+    upstream_calls = 0
+
+    async def fetch():
+        nonlocal upstream_calls
+        upstream_calls += 1
+        await asyncio.sleep(latency)
+        return "result"
+
+    results = await asyncio.gather(*[flights.do("key", fetch) for _ in range(callers)])
+    assert upstream_calls == 1, f"expected 1 upstream call, got {upstream_calls}"
+    assert results == ["result"] * callers
+    assert flights.coalesced == callers - 1
+    assert not flights.calls, "finished flights should be forgotten"
+    print(f"SingleFlight: {callers} concurrent callers -> {upstream_calls} upstream call")
+
+    # a failing call is handed to every caller and isn't remembered
+    async def fail():
+        nonlocal upstream_calls
+        upstream_calls += 1
+        await asyncio.sleep(latency)
+        raise RuntimeError("upstream failed")
+
+    upstream_calls = 0
+    results = await asyncio.gather(*[flights.do("key", fail) for _ in range(callers)], return_exceptions=True)
+    assert upstream_calls == 1, f"expected 1 upstream call, got {upstream_calls}"
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not flights.calls
+    print(f"SingleFlight: {callers} concurrent callers of a failing call -> {upstream_calls} upstream call")
+
+
+async def check_http_cache(callers: int, latency: float):
+    session = CountingSession(latency=latency)
+    cache = HTTPCache(session)
+
+    url = "https://xkcd.com/353/info.0.json"
+    entries = await asyncio.gather(*[cache.get(url) for _ in range(callers)])
+    assert session.requests == 1, f"expected 1 upstream request, got {session.requests}"
+    assert all(entry is entries[0] for entry in entries)
+    print(f"HTTPCache:    {callers} concurrent gets -> {session.requests} upstream request")
+
+    await cache.get(url)
+    assert session.requests == 1, "a fresh entry should be served from the cache"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that concurrent identical requests make one upstream request.")
+    parser.add_argument("--callers", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.1, help="Simulated upstream latency in seconds.")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(check_single_flight(args.callers, args.latency))
+    loop.run_until_complete(check_http_cache(args.callers, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+A stand-in for lavalink that speaks enough of its REST api and websocket protocol for the Music cog to run
+without lavalink or youtube. Tracks are synthetic and events are emitted on a schedule.
+
+Run it on its own and point a node at it:
+
+    python -m scripts.fake_lavalink --port 2333 --password youshallnotpass
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+
+from contextlib import suppress
+from aiohttp import web, WSMsgType
+
+DEFAULT_PORT = 2333
+DEFAULT_PASSWORD = "youshallnotpass"
+TRACK_LENGTH = 10  # seconds
+EXCEPTION_RATE = 0.01
+SEARCH_RESULTS = 5
+PLAYLIST_SIZE = 50
+STATS_INTERVAL = 5
+
+
+def make_track(key: str, *, length: int):
+    """
+    Builds a synthetic track in the same shape as lavalink's. The encoded track is the base64 of the track info,
+    so that the server can tell how long a track is when it's played.
+    """
+    identifier = hashlib.sha1(key.encode("utf-8")).hexdigest()[:11]
+    info = {
+        "identifier": identifier,
+        "isSeekable": True,
+        "author": "Fake Lavalink",
+        "length": length,
+        "isStream": False,
+        "position": 0,
+        "title": f"Synthetic track {identifier}",
+        "uri": f"https://www.youtube.com/watch?v={identifier}",
+        "sourceName": "youtube"
+    }
+    return {"track": base64.b64encode(json.dumps(info).encode("utf-8")).decode("utf-8"), "info": info}
+
+
+def decode_track(track: str):
+    return json.loads(base64.b64decode(track))
+
+
+class FakePlayer:
+    """
+    Playback state for one guild on one websocket connection.
+    """
+    def __init__(self, guild_id: str):
+        self.guild_id = guild_id
+        self.track = None
+        self.length = 0
+        self.started_at = 0  # time.monotonic() that position 0 would have been at
+        self.paused_at = None
+        self.end_task = None
+
+    @property
+    def position(self):
+        if self.track is None:
+            return 0
+        return int(((self.paused_at or time.monotonic()) - self.started_at) * 1000)
+
+    def cancel(self):
+        if self.end_task is not None:
+            self.end_task.cancel()
+            self.end_task = None
+
+
+class FakeLavalink:
+    """
+    The fake lavalink server.
+
+    `track_length` - The length of every synthetic track, in seconds.
+    `exception_rate` - The chance that a track fails part way through with a TrackExceptionEvent.
+    """
+    def __init__(self, *, password: str = DEFAULT_PASSWORD, track_length: float = TRACK_LENGTH,
+                 exception_rate: float = EXCEPTION_RATE, playlist_size: int = PLAYLIST_SIZE,
+                 stats_interval: float = STATS_INTERVAL):
+        self.password = password
+        self.track_length = track_length
+        self.exception_rate = exception_rate
+        self.playlist_size = playlist_size
+        self.stats_interval = stats_interval
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get("/", self.websocket),
+            web.get("/loadtracks", self.loadtracks),
+            web.get("/decodetrack", self.decodetrack)
+        ])
+        self.runner = None
+        self.connections = {}  # websocket: {guild_id: FakePlayer}
+        self.started = time.monotonic()
+
+        # metrics
+        self.finished_at = {}  # guild_id: time.monotonic() the last TrackEndEvent with reason FINISHED was sent
+        self.gaps = []  # seconds between a FINISHED TrackEndEvent and the next play op for the same guild
+        self.ops = 0
+        self.events = 0
+
+    # lifecycle
+
+    async def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def close(self):
+        for players in self.connections.values():
+            for player in players.values():
+                player.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    # rest
+
+    def authorized(self, request: web.Request):
+        return request.headers.get("Authorization") == self.password
+
+    async def loadtracks(self, request: web.Request):
+        if not self.authorized(request):
+            raise web.HTTPUnauthorized()
+        identifier = request.query.get("identifier", "")
+        length = int(self.track_length * 1000)
+
+        if identifier.startswith("ytsearch:"):
+            query = identifier[len("ytsearch:"):]
+            if not query.strip():
+                return web.json_response({"loadType": "NO_MATCHES", "playlistInfo": {}, "tracks": []})
+            tracks = [make_track(f"{query}:{i}", length=length) for i in range(SEARCH_RESULTS)]
+            return web.json_response({"loadType": "SEARCH_RESULT", "playlistInfo": {}, "tracks": tracks})
+        if "list=" in identifier:
+            tracks = [make_track(f"{identifier}:{i}", length=length) for i in range(self.playlist_size)]
+            return web.json_response({"loadType": "PLAYLIST_LOADED", "tracks": tracks,
+                                      "playlistInfo": {"name": f"Synthetic playlist {identifier[-8:]}", "selectedTrack": -1}})
+        return web.json_response({"loadType": "TRACK_LOADED", "playlistInfo": {},
+                                  "tracks": [make_track(identifier, length=length)]})
+
+    async def decodetrack(self, request: web.Request):
+        if not self.authorized(request):
+            raise web.HTTPUnauthorized()
+        return web.json_response(decode_track(request.query["track"]))
+
+    # websocket
+
+    async def websocket(self, request: web.Request):
+        if not self.authorized(request):
+            raise web.HTTPUnauthorized()
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections[ws] = players = {}
+        stats_task = asyncio.create_task(self.send_stats(ws))
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                data = json.loads(message.data)
+                self.ops += 1
+                if "guildId" in data:
+                    player = players.setdefault(data["guildId"], FakePlayer(data["guildId"]))
+                    await self.handle_op(ws, player, data)
+        finally:
+            stats_task.cancel()
+            for player in players.values():
+                player.cancel()
+            del self.connections[ws]
+        return ws
+
+    async def send(self, ws: web.WebSocketResponse, **data):
+        if not ws.closed:
+            with suppress(ConnectionResetError):  # the client went away mid-send
+                await ws.send_str(json.dumps(data))
+
+    async def send_event(self, ws: web.WebSocketResponse, player: FakePlayer, type_: str, **data):
+        self.events += 1
+        if type_ == "TrackEndEvent" and data["reason"] == "FINISHED":
+            self.finished_at[player.guild_id] = time.monotonic()
+        await self.send(ws, op="event", type=type_, guildId=player.guild_id, **data)
+
+    async def send_player_update(self, ws: web.WebSocketResponse, player: FakePlayer):
+        await self.send(ws, op="playerUpdate", guildId=player.guild_id,
+                        state={"time": int(time.time() * 1000), "position": player.position})
+
+    async def handle_op(self, ws: web.WebSocketResponse, player: FakePlayer, data: dict):
+        op = data["op"]
+        if op == "play":
+            if (finished_at := self.finished_at.pop(player.guild_id, None)) is not None:
+                self.gaps.append(time.monotonic() - finished_at)
+            if player.track is not None:
+                if data.get("noReplace"):
+                    return
+                player.cancel()
+                await self.send_event(ws, player, "TrackEndEvent", track=player.track, reason="REPLACED")
+            info = decode_track(data["track"])
+            player.track = data["track"]
+            player.length = int(data.get("endTime") or info["length"])
+            player.started_at = time.monotonic() - int(data.get("startTime") or 0) / 1000
+            player.paused_at = None
+            await self.send_event(ws, player, "TrackStartEvent", track=player.track)
+            await self.send_player_update(ws, player)
+            self.schedule_end(ws, player)
+        elif op == "stop":
+            if player.track is not None:
+                player.cancel()
+                track, player.track = player.track, None
+                await self.send_event(ws, player, "TrackEndEvent", track=track, reason="STOPPED")
+        elif op == "pause":
+            if data["pause"] and player.paused_at is None:
+                player.paused_at = time.monotonic()
+                player.cancel()
+            elif not data["pause"] and player.paused_at is not None:
+                player.started_at += time.monotonic() - player.paused_at
+                player.paused_at = None
+                self.schedule_end(ws, player)
+        elif op == "seek":
+            if player.track is not None:
+                player.started_at = (player.paused_at or time.monotonic()) - data["position"] / 1000
+                if player.paused_at is None:
+                    player.cancel()
+                    self.schedule_end(ws, player)
+        elif op == "destroy":
+            player.cancel()
+            self.connections[ws].pop(player.guild_id, None)
+        # voiceUpdate, volume and equalizer don't affect the simulation
+
+    def schedule_end(self, ws: web.WebSocketResponse, player: FakePlayer):
+        remaining = max(player.length - player.position, 0) / 1000
+        player.end_task = asyncio.create_task(self.end_track(ws, player, remaining))
+
+    async def end_track(self, ws: web.WebSocketResponse, player: FakePlayer, delay: float):
+        if random.random() < self.exception_rate:
+            # lavaplayer reports the exception and then ends the track, like lavalink does
+            await asyncio.sleep(random.uniform(0, delay))
+            track, player.track, player.end_task = player.track, None, None
+            await self.send_event(ws, player, "TrackExceptionEvent", track=track,
+                                  error="Synthetic playback failure", exception={"message": "Synthetic playback failure",
+                                                                                 "severity": "COMMON"})
+            await self.send_event(ws, player, "TrackEndEvent", track=track, reason="LOAD_FAILED")
+            return
+        await asyncio.sleep(delay)
+        track, player.track, player.end_task = player.track, None, None
+        await self.send_event(ws, player, "TrackEndEvent", track=track, reason="FINISHED")
+
+    async def send_stats(self, ws: web.WebSocketResponse):
+        while not ws.closed:
+            players = self.connections.get(ws, {})
+            playing = [player for player in players.values() if player.track is not None]
+            for player in playing:
+                await self.send_player_update(ws, player)
+            await self.send(
+                ws,
+                op="stats",
+                players=len(players),
+                playingPlayers=len(playing),
+                uptime=int((time.monotonic() - self.started) * 1000),
+                memory={"free": 0, "used": 0, "allocated": 0, "reservable": 0},
+                cpu={"cores": 1, "systemLoad": 0.0, "lavalinkLoad": 0.0},
+                frameStats={"sent": 3000 * len(playing), "nulled": 0, "deficit": 0}
+            )
+            await asyncio.sleep(self.stats_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a fake lavalink server with synthetic tracks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--track-length", type=float, default=TRACK_LENGTH, help="Track length in seconds.")
+    parser.add_argument("--exception-rate", type=float, default=EXCEPTION_RATE)
+    args = parser.parse_args()
+
+    server = FakeLavalink(password=args.password, track_length=args.track_length, exception_rate=args.exception_rate)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start(args.host, args.port))
+    print(f"Fake lavalink listening on {args.host}:{args.port}")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Drives simulated music sessions through the Music cog against fake lavalink nodes and reports how long track
+events take to handle and how long the gap between songs is.
+
+Discord itself is replaced by in-memory channels, a no-op gateway and an in-memory redis, everything else
+(the cog, players, song queue, search cache, node pool and wavelink) is the real code.
+
+    python -m scripts.loadtest --players 2000 --duration 60 --track-length 5
+"""
+import argparse
+import asyncio
+import fnmatch
+import itertools
+import random
+import time
+
+import discord
+from discord.ext import commands
+
+import cogs.Music as music_module
+from scripts.fake_lavalink import FakeLavalink, DEFAULT_PASSWORD
+from utils.utils import EditScheduler
+
+REQUESTER_ID = 1
+START_BATCH_SIZE = 100
+
+
+# stand-ins for discord and redis
+
+
+class MemoryRedis:
+    """
+    The subset of aioredis the Music cog uses, kept in memory.
+    """
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key: str, *, encoding: str = None):
+        value = self.data.get(key)
+        if value is not None and encoding is not None and isinstance(value, bytes):
+            return value.decode(encoding)
+        return value
+
+    async def set(self, key: str, value, *, expire: int = 0):
+        self.data[key] = value.encode("utf-8") if isinstance(value, str) else value
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def iscan(self, *, match: str = "*"):
+        for key in list(self.data):
+            if fnmatch.fnmatch(key, match):
+                yield key.encode("utf-8")
+
+
+class FakeMessage:
+    ids = itertools.count(1)
+
+    def __init__(self, channel):
+        self.id = next(self.ids)
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        await self.channel.api_call()
+
+    async def delete(self):
+        await self.channel.api_call()
+
+
+class FakeChannel:
+    """
+    A text channel whose api calls take `latency` seconds, give or take 50%.
+    """
+    def __init__(self, channel_id: int, *, latency: float):
+        self.id = channel_id
+        self.latency = latency
+        self.calls = 0
+
+    async def api_call(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    async def send(self, *args, **kwargs):
+        await self.api_call()
+        return FakeMessage(self)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.shard_id = 0
+
+    def get_channel(self, channel_id: int):
+        return None
+
+    def get_member(self, member_id: int):
+        return None
+
+
+class FakeGateway:
+    async def voice_state(self, guild_id: int, channel_id, self_mute: bool = False, self_deaf: bool = False):
+        pass
+
+
+class LoadTestBot(commands.Bot):
+    """
+    Just enough of PB_Bot for the Music cog to run without a discord connection.
+    """
+    def __init__(self):
+        super().__init__(command_prefix="pb")
+        self._connection.user = discord.Object(id=0)
+        self._ready.set()
+        self.ws = FakeGateway()
+        self.redis = MemoryRedis()
+        self.embed_colour = 0x01ad98
+        self.emoji_dict = {"red_line": "-", "white_line": "="}
+        self.edit_scheduler = EditScheduler(self.loop)
+        self.wavelink = music_module.wavelink.Client(bot=self)
+        self.guilds_ = {}
+
+    def get_guild(self, guild_id: int):
+        return self.guilds_.setdefault(guild_id, FakeGuild(guild_id))
+
+
+# reporting
+
+
+def summarize(samples: list):
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+
+    def pick(quantile):
+        return samples[min(int(quantile * len(samples)), len(samples) - 1)] * 1000
+
+    return (f"n={len(samples)} p50={pick(0.5):.1f}ms p95={pick(0.95):.1f}ms "
+            f"p99={pick(0.99):.1f}ms max={samples[-1] * 1000:.1f}ms")
+
+
+# load test
+
+
+async def run(args):
+    servers = [FakeLavalink(track_length=args.track_length, exception_rate=args.exception_rate,
+                            playlist_size=args.playlist_size) for _ in range(args.nodes)]
+    for i, server in enumerate(servers):
+        await server.start(port=args.port + i)
+    music_module.config = {**music_module.config, "wavelink_nodes": [
+        {"host": "127.0.0.1", "port": args.port + i, "rest_uri": f"http://127.0.0.1:{args.port + i}",
+         "password": DEFAULT_PASSWORD, "identifier": f"fake-{i}", "region": "us_central"}
+        for i in range(args.nodes)
+    ]}
+
+    bot = LoadTestBot()
+    music = music_module.Music(bot)
+
+    # time how long the cog takes to handle each TrackEndEvent
+    handling = []
+    errors = 0
+    on_node_event = music.on_node_event
+
+    async def timed_on_node_event(event):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            await on_node_event(event)
+        except Exception:
+            errors += 1
+            raise
+        finally:
+            if isinstance(event, music_module.wavelink.TrackEnd):
+                handling.append(time.perf_counter() - start)
+
+    music.on_node_event = timed_on_node_event
+
+    while len(bot.wavelink.nodes) < args.nodes:
+        await asyncio.sleep(0.1)
+
+    channels = []
+
+    async def start_session(guild_id: int):
+        player = music.get_player(guild_id)
+        await player.connect(guild_id)
+        player.session_chan = FakeChannel(guild_id, latency=args.api_latency)
+        player.dj = REQUESTER_ID
+        player.session_started = True
+        channels.append(player.session_chan)
+
+        requester = discord.Object(id=REQUESTER_ID)
+        playlist = await bot.wavelink.get_tracks(f"https://www.youtube.com/playlist?list=loadtest{guild_id}")
+        player.enqueue(playlist.tracks, requester)
+        player.enqueue(await music.track_cache.search(f"song {guild_id % args.distinct_queries}", guild_id=guild_id),
+                       requester)
+        await player.play(player.queue.pop())
+
+    start = time.perf_counter()
+    for first in range(1, args.players + 1, START_BATCH_SIZE):
+        await asyncio.gather(*[start_session(guild_id)
+                               for guild_id in range(first, min(first + START_BATCH_SIZE, args.players + 1))])
+    print(f"Started {args.players} sessions on {args.nodes} node(s) in {time.perf_counter() - start:.2f}s")
+
+    await asyncio.sleep(args.duration)
+
+    print(f"Track ends handled: {len(handling)} ({len(handling) / args.duration:.1f}/s), {errors} raised")
+    print(f"Track end handling: {summarize(handling)}")
+    print(f"Inter-track gap:    {summarize([gap for server in servers for gap in server.gaps])}")
+    print(f"Gap seen by the cog: {summarize(list(music.gaps))}")
+    print(f"Lavalink ops:       {sum(server.ops for server in servers)}")
+    print(f"Discord api calls:  {sum(channel.calls for channel in channels)}")
+    print(f"Message edits:      {dict(bot.edit_scheduler.stats)}, {len(bot.edit_scheduler.pending)} pending")
+    print(f"Search cache:       {dict(music.track_cache.totals)}")
+    print(f"Players left:       {len(bot.wavelink.players)}")
+
+    music.cog_unload()
+    bot.edit_scheduler.close()
+    await asyncio.gather(*[player.destroy() for player in bot.wavelink.players.values()])
+    for node in list(bot.wavelink.nodes.values()):
+        await node.destroy()
+    await asyncio.sleep(1)  # let in-flight event handlers finish before the websockets close
+    await bot.wavelink.session.close()
+    for server in servers:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests the Music cog against fake lavalink nodes.")
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60, help="How long to run for, in seconds.")
+    parser.add_argument("--nodes", type=int, default=1)
+    parser.add_argument("--port", type=int, default=2333, help="The port of the first fake node.")
+    parser.add_argument("--track-length", type=float, default=5, help="Track length in seconds.")
+    parser.add_argument("--exception-rate", type=float, default=0.01)
+    parser.add_argument("--playlist-size", type=int, default=20)
+    parser.add_argument("--distinct-queries", type=int, default=50, help="How many different songs get searched for.")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Simulated discord api latency in seconds.")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
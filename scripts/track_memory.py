@@ -0,0 +1,91 @@
+"""
+Measures how much memory a queue of synthetic tracks holds on to, comparing the compact `Track` records the Music cog
+queues now with the `wavelink.Track` subclass (holding lavalink's info dict and the requester) it used to queue.
+
+    python -m scripts.track_memory --tracks 100000
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+import wavelink
+
+import cogs.Music as music_module
+from scripts.fake_lavalink import make_track
+
+
+class WavelinkTrack(wavelink.Track):
+    """
+    The track the Music cog used to queue.
+    """
+    __slots__ = ("requester",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args)
+
+        self.requester = kwargs.get("requester")
+
+
+class Requester:
+    """
+    Stands in for the `discord.Member` the old tracks held on to. Members are shared, so it's only counted once.
+    """
+    def __init__(self, member_id: int):
+        self.id = member_id
+
+
+def lavalink_tracks(amount: int):
+    """
+    Yields tracks the way wavelink gets them, freshly parsed from a lavalink response.
+    """
+    for i in range(amount):
+        yield json.loads(json.dumps(make_track(f"memory benchmark {i}", length=213000)))
+
+
+def measure(build, amount: int):
+    """
+    Returns how many bytes the structure returned by `build` keeps alive once the lavalink responses are gone.
+    """
+    gc.collect()
+    tracemalloc.start()
+    structure = build(lavalink_tracks(amount))
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del structure
+    return retained
+
+
+def build_wavelink_queue(data):
+    requester = Requester(1)
+    return [WavelinkTrack(track["track"], track["info"], requester=requester) for track in data]
+
+
+def build_compact_list(data):
+    return [music_module.Track.from_wavelink(wavelink.Track(track["track"], track["info"]), 1) for track in data]
+
+
+def build_compact_queue(data):
+    queue = music_module.SongQueue()
+    queue.extend(music_module.Track.from_wavelink(wavelink.Track(track["track"], track["info"]), 1) for track in data)
+    return queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the memory used by queued tracks.")
+    parser.add_argument("--tracks", type=int, default=100000)
+    args = parser.parse_args()
+
+    wavelink_bytes = measure(build_wavelink_queue, args.tracks)
+    compact_bytes = measure(build_compact_list, args.tracks)
+    queue_bytes = measure(build_compact_queue, args.tracks)
+    print(f"{args.tracks} tracks")
+    for name, retained in (("wavelink.Track list", wavelink_bytes), ("Track record list", compact_bytes),
+                           ("Track records in a SongQueue", queue_bytes)):
+        print(f"{name + ':':<30} {retained / 2 ** 20:6.1f} MiB ({retained / args.tracks:.0f} bytes/track, "
+              f"{retained / wavelink_bytes:.0%} of wavelink.Track)")
+
+
+if __name__ == "__main__":
+    main()
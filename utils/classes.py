@@ -15,7 +15,8 @@ from discord.ext import commands, tasks
 from copy import deepcopy
 from pyfiglet import Figlet
 
-from .utils import StopWatch
+from .utils import StopWatch, EditScheduler, ReactionRouter, SnakeScheduler
+from .web import HTTPCache, ResilientSession, CircuitOpen, UpstreamUnavailable, PasteService, PasteProvider, PasteStore, StorePasteProvider
 from config import config
 
 # constants
@@ -27,6 +28,14 @@ BOT_ID = "719907834120110182"
 PERMISSIONS = 104189127
 DESCRIPTION = "An easy to use, multipurpose discord bot written in Python by PB#4162."
 COMMITS_URL = "https://api.github.com/repos/PB4162/PB-Bot/commits"
+HTTP_CACHE_TTLS = {
+    "www.reddit.com": 60,
+    "xkcd.com": 86400,
+    "www.explainxkcd.com": 86400,
+    "api.dictionaryapi.dev": 86400,
+    "srhpyqt94yxb.statuspage.io": 60,
+    "api.github.com": 300,
+}
 
 
 async def get_prefix(bot, message: discord.Message):
@@ -68,12 +77,16 @@ class PB_Bot(commands.Bot):
 
         # general stuff
         self.start_time = datetime.datetime.now()
-        self.session = aiohttp.ClientSession()
+        self.session = ResilientSession()
         self.wavelink = wavelink.Client(bot=self)
+        self.edit_scheduler = EditScheduler(self.loop)
+        self.reaction_router = ReactionRouter(self.loop)
+        self.snake_scheduler = SnakeScheduler(self.loop, self.edit_scheduler)
         self.coglist = [f"cogs.{item[:-3]}" for item in os.listdir("cogs") if item != "__pycache__"] + ["jishaku"]
         self.command_list = []
         self.figlet = Figlet()
         self.embed_colour = EMBED_COLOUR
+        self.recent_commits = []
 
         # database connections
         self.pool = self.loop.run_until_complete(asyncpg.create_pool(**config["postgresql"]))
@@ -81,6 +94,17 @@ class PB_Bot(commands.Bot):
 
         # cache
         self.cache = Cache(self)
+        self.http_cache = HTTPCache(
+            self.session, redis=self.redis if config.get("http_cache_redis") else None, ttls=HTTP_CACHE_TTLS)
+
+        # pastebin
+        paste_providers = [PasteProvider("mystbin", "https://mystb.in"), PasteProvider("hastebin", "https://hastebin.com")]
+        if paste_store := config.get("paste_store"):  # {"url": ..., "host": ..., "port": ..., "expire_after": ...}
+            self.paste_store = PasteStore(self.pool, **paste_store)
+            paste_providers.insert(0, StorePasteProvider(self.paste_store))
+        else:
+            self.paste_store = None
+        self.paste_service = PasteService(self.session, paste_providers)
 
         # links
         self.github_url = "https://github.com/PB4162/PB-Bot"
@@ -151,6 +175,14 @@ class PB_Bot(commands.Bot):
             return await ctx.invoke(self.get_command("prefix"))
         await self.process_commands(message)
 
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if payload.user_id != self.user.id:
+            self.reaction_router.dispatch("add", payload)
+
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        if payload.user_id != self.user.id:
+            self.reaction_router.dispatch("remove", payload)
+
     async def on_guild_leave(self, guild: discord.Guild):
         await self.cache.delete_guild_info(guild.id)
 
@@ -210,15 +242,28 @@ class PB_Bot(commands.Bot):
     async def dump_cmd_stats(self):
         await self.cache.dump_cmd_stats()
 
+    @tasks.loop(minutes=5)
+    async def refresh_commits(self):
+        try:
+            # ttl=0 makes every refresh a conditional request; github doesn't count 304s against the rate limit
+            r = await self.http_cache.get(COMMITS_URL, ttl=0)
+        except (CircuitOpen, UpstreamUnavailable):
+            return
+        if r.status == 200:
+            self.recent_commits = r.json()
+
+    @tasks.loop(hours=1)
+    async def purge_pastes(self):
+        await self.paste_store.purge_expired()
+
     # pastebin
 
     async def mystbin(self, data):
-        async with self.session.post("https://mystb.in/documents", data=data) as r:
-            return f"https://mystb.in/{(await r.json())['key']}"
+        # long outputs go to the built-in paste store when it's enabled
+        return await self.paste_service.paste(data, prefer="builtin" if self.paste_store else "mystbin")
 
     async def hastebin(self, data):
-        async with self.session.post("https://hastebin.com/documents", data=data) as r:
-            return f"https://hastebin.com/{(await r.json())['key']}"
+        return await self.paste_service.paste(data, prefer="hastebin")
 
     # other
 
@@ -231,9 +276,9 @@ class PB_Bot(commands.Bot):
         return commands.check(predicate)
 
     async def get_recent_commits(self, limit: int = 4):
-        async with self.session.get(COMMITS_URL) as r:
-            commits = await r.json()
-        return commits[:limit]
+        if not self.recent_commits:  # the first refresh hasn't finished yet
+            await self.refresh_commits()
+        return self.recent_commits[:limit]
 
     async def schemas(self):
         with open("schemas.sql") as f:
@@ -257,6 +302,14 @@ class PB_Bot(commands.Bot):
 
     async def close(self):
         await self.cache.dump_all()
+        if (music := self.get_cog("Music")) is not None:
+            await music.snapshot_players()
+        await self.session.close()
+        self.edit_scheduler.close()
+        self.reaction_router.close()
+        self.snake_scheduler.close()
+        if self.paste_store:
+            await self.paste_store.close()
         await super().close()
 
     def run(self, *args, **kwargs):
@@ -271,6 +324,10 @@ class PB_Bot(commands.Bot):
         self.presence_update.start()
         self.dump_cmd_stats.start()
         self.clear_cmd_stats.start()
+        self.refresh_commits.start()
+        if self.paste_store:
+            self.loop.run_until_complete(self.paste_store.start())
+            self.purge_pastes.start()
         super().run(*args, **kwargs)
 
 
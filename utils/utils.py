@@ -5,8 +5,10 @@ from discord.ext import commands
 import datetime
 import time
 import random
-from collections import deque
+from collections import Counter, OrderedDict, defaultdict, deque
 import asyncio
+import json
+import logging
 import dateparser
 import humanize
 import typing
@@ -15,6 +17,10 @@ import textwrap
 from contextlib import suppress
 from aiohttp import InvalidURL
 
+from .web import UpstreamUnavailable
+
+log = logging.getLogger(__name__)
+
 
 # helper functions
 
@@ -43,6 +49,24 @@ def humanize_list(li: list):
     return f"{', '.join(str(item) for item in li[:-1])} and {li[-1]}"
 
 
+def parse_timestamp(timestamp: str):
+    """
+    Parses an ISO-8601 timestamp, only falling back to `dateparser` (which is slow) for anything unusual.
+    """
+    try:
+        return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return dateparser.parse(timestamp)
+
+
+def progress_bar(position: float, length: float, emoji_dict: dict, *, size: int = 20):
+    """
+    Makes the progress bar used by the player and now playing messages.
+    """
+    bar_number = min(int(position / length * size), size - 1) if length else 0
+    return f"\\||{bar_number * emoji_dict['red_line']}⚫{(size - 1 - bar_number) * emoji_dict['white_line']}||"
+
+
 class StopWatch:
     __slots__ = ("start_time", "end_time")
 
@@ -149,36 +173,22 @@ class DiscordStatusSource(menus.ListPageSource):
         return page
 
 
-class HistorySource(menus.ListPageSource):
-    async def format_page(self, menu: menus.MenuPages, page):
-        embed = discord.Embed(
-            title="Discord Status\nHistorical Data",
-            description="```yaml\n"
-                        f"Name: {page['name']}\n"
-                        f"Status: {page['status'].title()}\n"
-                        f"Created: {humanize.naturaldate(dateparser.parse(page['created_at'])).title()}\n"
-                        f"Impact: {page['impact'].title()}" 
-                        f"```",
-            colour=menu.ctx.bot.embed_colour)
-        embed.set_footer(text=f"Page {menu.current_page + 1}/{self.get_max_pages()}")
-        return embed
-
-
 class DefineSource(menus.ListPageSource):
     def __init__(self, data, response):
         super().__init__(data, per_page=1)
         self.response = response
 
     async def format_page(self, menu: menus.MenuPages, page):
+        part_of_speech, definitions = page
         embed = discord.Embed(
             title=f"Definitions for word `{self.response['word']}`",
-            description=f"{self.response['phonetics'][0]['text']}\n"
-                        f"[audio]({self.response['phonetics'][0]['audio']})",
+            description=f"{self.response['phonetic'] or ''}\n"
+                        f"[audio]({self.response['audio']})" if self.response["audio"] else self.response["phonetic"],
             colour=menu.ctx.bot.embed_colour)
         defs = []
-        for definition in page["definitions"]:
-            defs.append(f"**Definition:** {definition['definition']}\n**Example:** {definition.get('example', 'None')}")
-        embed.add_field(name=f"`{page['partOfSpeech']}`", value="\n\n".join(defs))
+        for definition, example in definitions:
+            defs.append(f"**Definition:** {definition}\n**Example:** {example or 'None'}")
+        embed.add_field(name=f"`{part_of_speech}`", value="\n\n".join(defs))
         embed.set_footer(text=f"Page {menu.current_page + 1}/{self.get_max_pages()}")
         return embed
 
@@ -196,16 +206,16 @@ class TodoSource(menus.ListPageSource):
 
 
 class QueueSource(menus.ListPageSource):
-    def __init__(self, data, player):
+    def __init__(self, data, current_number: int = None):
         super().__init__(data, per_page=5)
 
-        self.player = player
+        self.current_number = current_number
 
     async def format_page(self, menu: menus.MenuPages, page):
         embed = discord.Embed(
             title="Song Queue",
             description="\n".join(
-                f"**{number}.** {item}" if number != self.player.queue_position else f"*current song* ﹁\n**{number}.** {item}\n﹂ *current song*"
+                f"**{number}.** {item}" if number != self.current_number else f"*current song* ﹁\n**{number}.** {item}\n﹂ *current song*"
                 for number, item in page) or "Nothing in the queue!",
             colour=menu.ctx.bot.embed_colour)
         if self.get_max_pages() > 0:
@@ -354,64 +364,91 @@ class PaginatedHelpCommand(menus.MenuPages):
 
 class PlayerMenu(menus.Menu):
     """
-    Player menu class.
+    Player menu class. Refreshes itself through the bot's edit scheduler.
     """
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-        self.embed = None
+        self.player = None
+        self.show_info = False
+        self.song_details = None  # (track id, channel name, duration), these only change with the song
 
     async def send_initial_message(self, ctx, channel: discord.TextChannel):
-        ctx.player.menus.append(self)
-        self.build_embed()
-        return await channel.send(embed=self.embed)
-
-    async def build_edit(self):
-        self.build_embed()
-        await self.message.edit(embed=self.embed)
+        self.player = ctx.player
+        self.player.menus.append(self)
+        message = await channel.send(**self.render())
+        ctx.bot.edit_scheduler.register(message, self.render)
+        return message
+
+    async def finalize(self, timed_out):
+        self.ctx.bot.edit_scheduler.unregister(self.message)
+        with suppress(ValueError):
+            self.player.menus.remove(self)
+
+    def refresh(self):
+        self.ctx.bot.edit_scheduler.refresh(self.message)
+
+    def render(self):
+        if self.show_info:
+            return {"embed": self.build_info_embed()}
+        if self.player.current is None:
+            return None
+        return {"embed": self.build_embed()}
 
     def build_embed(self):
-        max_song_length = float(f"{self.ctx.player.current.length / 1000:.2f}")
-        current_position = float(f"{self.ctx.player.position / 1000:.2f}")
-        bar_number = int((int(current_position) / int(max_song_length)) * 20)
-        bar = f"\||{bar_number * self.ctx.bot.emoji_dict['red_line']}⚫{(19 - bar_number) * self.ctx.bot.emoji_dict['white_line']}||"
-        try:
-            coming_up = self.ctx.player.queue[self.ctx.player.queue_position]
-        except IndexError:
-            coming_up = "None"
+        player = self.player
+        if self.song_details is None or self.song_details[0] != player.current.id:
+            self.song_details = (
+                player.current.id,
+                self.ctx.guild.get_channel(player.channel_id).name,
+                humanize.precisedelta(datetime.timedelta(milliseconds=player.current.length))
+            )
+        _, channel_name, duration = self.song_details
+        position = player.position
+        coming_up = player.queue.peek() or "None"
 
-        self.embed = discord.Embed(
+        embed = discord.Embed(
             title=f"Player for `{self.ctx.guild}`",
             description=
-            f"**Status:** `{'Paused' if self.ctx.player.is_paused else 'Playing'}`\n"
-            f"**Connected To:** `{self.ctx.guild.get_channel(self.ctx.player.channel_id).name}`\n"
-            f"**Volume:** `{self.ctx.player.volume}`\n"
-            f"**Equalizer:** `{self.ctx.player.equalizer}`",
+            f"**Status:** `{'Paused' if player.is_paused else 'Playing'}`\n"
+            f"**Connected To:** `{channel_name}`\n"
+            f"**Volume:** `{player.volume}`\n"
+            f"**Equalizer:** `{player.equalizer}`",
             colour=self.ctx.bot.embed_colour
         )
-        self.embed.add_field(name="Now Playing:", value=f"{self.ctx.player.current}", inline=False)
-        self.embed.add_field(name="Duration:", value=humanize.precisedelta(datetime.timedelta(milliseconds=self.ctx.player.current.length)), inline=False)
-        self.embed.add_field(name="Time Elapsed:", value=humanize.precisedelta(datetime.timedelta(milliseconds=self.ctx.player.position)), inline=False)
-        self.embed.add_field(name="YT Link:", value=f"[Click Here!]({self.ctx.player.current.uri})", inline=False)
-        self.embed.add_field(name="Coming Up...", value=coming_up, inline=False)
-        self.embed.add_field(name="Progress", value=bar, inline=False)
+        embed.add_field(name="Now Playing:", value=f"{player.current}", inline=False)
+        embed.add_field(name="Duration:", value=duration, inline=False)
+        embed.add_field(name="Time Elapsed:", value=humanize.precisedelta(datetime.timedelta(seconds=int(position / 1000))), inline=False)
+        embed.add_field(name="YT Link:", value=f"[Click Here!]({player.current.uri})", inline=False)
+        embed.add_field(name="Coming Up...", value=coming_up, inline=False)
+        embed.add_field(name="Progress", value=progress_bar(position, player.current.length, self.ctx.bot.emoji_dict), inline=False)
+        return embed
+
+    def build_info_embed(self):
+        return discord.Embed(
+            title="How to use the Player",
+            description=
+            "⏮️ go back to the previous song\n"
+            "⏭️  skip the current song\n" 
+            "⏯️  pause and unpause the player\n"
+            "🔈 opens the volume bar and closes the player\n"
+            "ℹ️  shows this message\n"
+            "🔁 refreshes the player\n"
+            "⏹️  close the player",
+            colour=self.ctx.bot.embed_colour)
 
     @menus.button("⏮️")
     async def song_previous(self, _):
-        await self.ctx.player.do_previous()
-        if self.ctx.player.queue_position > len(self.ctx.player.queue) - 1:
-            await self.build_edit()
+        await self.player.do_previous()
 
     @menus.button("⏭️")
     async def song_skip(self, _):
-        await self.ctx.player.stop()
-        if self.ctx.player.queue_position < len(self.ctx.player.queue) - 1:
-            await self.build_edit()
+        await self.player.stop()
 
     @menus.button("⏯️")
     async def play_pause(self, _):
-        await self.ctx.player.set_pause(False if self.ctx.player.paused else True)
-        await self.build_edit()
+        await self.player.set_pause(False if self.player.paused else True)
+        self.refresh()
 
     @menus.button("🔈")
     async def volume(self, _):
@@ -420,26 +457,12 @@ class PlayerMenu(menus.Menu):
 
     @menus.button("ℹ️")
     async def on_menu_info(self, _):
-        embed = discord.Embed(
-            title="How to use the Player",
-            description=
-            "⏮️ go back to the previous song\n"
-            "⏭️  skip the current song\n" 
-            "⏯️  pause and unpause the player\n"
-            "🔈 opens the volume bar and closes the player\n"
-            "ℹ️  shows this message\n"
-            "🔁 refreshes the player\n"
-            "⏹️  close the player",
-            colour=self.ctx.bot.embed_colour)
-        if self.embed.title == "How to use the Player":  # hide the menu info screen
-            self.build_embed()
-        else:
-            self.embed = embed
-        await self.message.edit(embed=self.embed)
+        self.show_info = not self.show_info  # the info screen hides when pressed again
+        self.refresh()
 
     @menus.button("🔁")
     async def on_refresh(self, _):
-        await self.build_edit()
+        self.refresh()
 
     @menus.button("⏹️")
     async def on_menu_close(self, _):
@@ -450,77 +473,85 @@ class VolumeMenu(menus.Menu):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-        self.embed = None
+        self.player = None
+        self.show_info = False
 
     async def send_initial_message(self, ctx, channel: discord.TextChannel):
-        ctx.player.menus.append(self)
-        self.build_embed()
-        return await channel.send(embed=self.embed)
+        self.player = ctx.player
+        self.player.menus.append(self)
+        message = await channel.send(**self.render())
+        ctx.bot.edit_scheduler.register(message, self.render)
+        return message
+
+    async def finalize(self, timed_out):
+        self.ctx.bot.edit_scheduler.unregister(self.message)
+        with suppress(ValueError):
+            self.player.menus.remove(self)
+
+    def refresh(self):
+        self.ctx.bot.edit_scheduler.refresh(self.message)
+
+    def render(self):
+        return {"embed": self.build_info_embed() if self.show_info else self.build_embed()}
 
     def build_embed(self):
-        volume_bar_number = int(self.ctx.player.volume / 100 * 2)
+        volume_bar_number = int(self.player.volume / 100 * 2)
         volume_bar = [(volume_bar_number - 1) * "🟦"] + [self.ctx.bot.emoji_dict["blue_button"]] + [(20 - volume_bar_number) * "⬜"]
-        self.embed = discord.Embed(title="Volume Bar", description="".join(volume_bar), colour=self.ctx.bot.embed_colour)
-        self.embed.set_footer(text=f"Current Volume: {self.ctx.player.volume}")
+        embed = discord.Embed(title="Volume Bar", description="".join(volume_bar), colour=self.ctx.bot.embed_colour)
+        embed.set_footer(text=f"Current Volume: {self.player.volume}")
+        return embed
 
-    async def build_edit(self):
-        self.build_embed()
-        await self.message.edit(embed=self.embed)
+    def build_info_embed(self):
+        return discord.Embed(
+            title="How to use the Volume Bar",
+            description=
+            "⏮️ decrease the volume by 100\n"
+            "⏪ decrease the volume by 10\n"
+            "⬅️ decrease the volume by 1\n"
+            "➡️ increase the volume by 1\n"
+            "⏩ increase the volume by 10\n"
+            "⏭️ increase the volume by 100\n"
+            "ℹ️ shows this message\n"
+            "🔁 refreshes the volume bar\n"
+            "⏹️ closes the volume bar",
+            colour=self.ctx.bot.embed_colour)
+
+    async def change_volume(self, amount: int):
+        await self.player.set_volume(self.player.volume + amount)
+        self.refresh()
 
     @menus.button("⏮️")
     async def on_volume_down_100(self, _):
-        await self.ctx.player.set_volume(self.ctx.player.volume - 100)
-        await self.build_edit()
+        await self.change_volume(-100)
 
     @menus.button("⏪")
     async def on_volume_down_10(self, _):
-        await self.ctx.player.set_volume(self.ctx.player.volume - 10)
-        await self.build_edit()
+        await self.change_volume(-10)
 
     @menus.button("⬅️")
     async def on_volume_down(self, _):
-        await self.ctx.player.set_volume(self.ctx.player.volume - 1)
-        await self.build_edit()
+        await self.change_volume(-1)
 
     @menus.button("➡️")
     async def on_volume_up(self, _):
-        await self.ctx.player.set_volume(self.ctx.player.volume + 1)
-        await self.build_edit()
+        await self.change_volume(1)
 
     @menus.button("⏩")
     async def on_volume_up_10(self, _):
-        await self.ctx.player.set_volume(self.ctx.player.volume + 10)
-        await self.build_edit()
+        await self.change_volume(10)
 
     @menus.button("⏭️")
     async def on_volume_up_100(self, _):
-        await self.ctx.player.set_volume(self.ctx.player.volume + 100)
-        await self.build_edit()
+        await self.change_volume(100)
 
     @menus.button("ℹ️")
     async def on_menu_info(self, _):
-        embed = discord.Embed(
-            title="How to use the Volume Bar",
-            description=
-            "⏮️ decrease the volume by 100\n"
-            "⏪ decrease the volume by 10\n"
-            "⬅️ decrease the volume by 1\n"
-            "➡️ increase the volume by 1\n"
-            "⏩ increase the volume by 10\n"
-            "⏭️ increase the volume by 100\n"
-            "ℹ️ shows this message\n"
-            "🔁 refreshes the volume bar\n"
-            "⏹️ closes the volume bar",
-            colour=self.ctx.bot.embed_colour)
-        if self.embed.title == "How to use the Volume Bar":  # hide the menu info screen
-            self.build_embed()
-        else:
-            self.embed = embed
-        await self.message.edit(embed=self.embed)
+        self.show_info = not self.show_info  # the info screen hides when pressed again
+        self.refresh()
 
     @menus.button("🔁")
     async def on_refresh(self, _):
-        await self.build_edit()
+        self.refresh()
 
     @menus.button("⏹️")
     async def on_menu_close(self, _):
@@ -608,8 +639,8 @@ class ImageConverter(commands.Converter):
                 if r.status in range(200, 300):
                     return await r.read()
 
-            # embedded images (links)
-            with suppress(InvalidURL):
+            # embedded images (links), anything that isn't a reachable url falls through to the attachments
+            with suppress(InvalidURL, UpstreamUnavailable):
                 async with self.bot.session.get(argument.strip("<>")) as r:
                     if r.status in range(200, 300) and ImageConverter.image_regex.fullmatch(r.headers["Content-Type"]):
                         return await r.read()
@@ -735,40 +766,35 @@ class SnakeMenu(menus.Menu):
         self.game = SnakeGame(empty="⬛")
         self.player_ids = player_ids
         self.direction = None
-        self.task = None
-        self.embed = None
-        self.is_game_start = asyncio.Event()
+        self.players = None
 
     async def send_initial_message(self, ctx: commands.Context, channel: discord.TextChannel):
-        await self.refresh_embed()
-        self.task = ctx.bot.loop.create_task(self.loop())
-        return await channel.send(embed=self.embed)
+        self.players = await self.get_players()
+        message = await channel.send(embed=self.build_embed())
+        ctx.bot.snake_scheduler.add(self)
+        return message
 
     async def get_players(self):
         if not self.player_ids:
             return "anyone can control the game"
-        players = [str(await self.ctx.bot.fetch_user(player_id)) for player_id in self.player_ids]
+        players = [str(self.ctx.bot.get_user(player_id) or await self.ctx.bot.fetch_user(player_id))
+                   for player_id in self.player_ids]
         if len(self.player_ids) > 10:
             first10 = "\n".join(player for player in players[:10])
             return f"{first10}\nand {len(players[10:])} more..."
         return "\n".join(str(player) for player in players)
 
-    async def refresh_embed(self):
-        self.embed = discord.Embed(title=f"Snake Game", description=self.game.show_grid(), colour=self.ctx.bot.embed_colour)
-        self.embed.add_field(name="Players", value=await self.get_players())
-        self.embed.add_field(name="Score", value=str(self.game.score))
-        self.embed.add_field(name="Current Direction", value=self.direction)
+    def build_embed(self):
+        embed = discord.Embed(title=f"Snake Game", description=self.game.show_grid(), colour=self.ctx.bot.embed_colour)
+        embed.add_field(name="Players", value=self.players)
+        embed.add_field(name="Score", value=str(self.game.score))
+        embed.add_field(name="Current Direction", value=self.direction)
+        if self.game.lose:
+            embed.add_field(name="Game Over", value=self.game.lose)
+        return embed
 
-    async def loop(self):
-        await self.is_game_start.wait()
-        while not self.game.lose:
-            await asyncio.sleep(1.5)
-            self.game.update(self.direction)
-            await self.refresh_embed()
-            await self.message.edit(embed=self.embed)
-        self.embed.add_field(name="Game Over", value=self.game.lose)
-        await self.message.edit(embed=self.embed)
-        self.stop()
+    async def finalize(self, timed_out):
+        self.ctx.bot.snake_scheduler.remove(self)
 
     def reaction_check(self, payload):
         if payload.message_id != self.message.id:
@@ -785,31 +811,23 @@ class SnakeMenu(menus.Menu):
     @menus.button("⬆️")
     async def up(self, _):
         self.direction = "up"
-        self.is_game_start.set()
 
     @menus.button("⬇️")
     async def down(self, _):
         self.direction = "down"
-        self.is_game_start.set()
 
     @menus.button("⬅️")
     async def left(self, _):
         self.direction = "left"
-        self.is_game_start.set()
 
     @menus.button("➡️")
     async def right(self, _):
         self.direction = "right"
-        self.is_game_start.set()
 
     @menus.button("⏹️")
     async def on_stop(self, _):
         self.stop()
 
-    def stop(self):
-        self.task.cancel()
-        super().stop()
-
 
 class TicTacToe:
     """
@@ -849,19 +867,15 @@ class TicTacToe:
     async def loop(self):
         while True:
             try:
-                move, user = await self.ctx.bot.wait_for(
-                    "reaction_add",
-                    check=lambda reaction, user: reaction.message.guild == self.ctx.guild
-                    and reaction.message.channel == self.ctx.message.channel
-                    and reaction.message == self.msg and str(reaction.emoji) in self.board.keys() and user == self.turn,
-                    timeout=300
-                )
+                _, payload = await self.ctx.bot.reaction_router.wait_for(
+                    self.msg, emojis=self.board.keys(), user_ids={self.turn.id}, timeout=300)
             except asyncio.TimeoutError:
                 await self.msg.edit(content=f"{self.show_board()}Game Over.\n**{self.turn}** took too long to move.")
                 await self.ctx.send(f"{self.turn.mention} game over, you took too long to move. {self.msg.jump_url}")
                 return
-            if self.board[move.emoji] == "⬜":
-                self.board[move.emoji] = self.player_mapping[self.turn]
+            move = str(payload.emoji)
+            if self.board[move] == "⬜":
+                self.board[move] = self.player_mapping[self.turn]
             else:
                 await self.msg.edit(content=f"{self.show_board()}**Current Turn**: `{self.turn}`\nThat place is already filled.")
                 continue
@@ -1031,3 +1045,316 @@ class PrettyTable:
         table.append(bottom)
 
         return "\n".join(table)
+
+
+class EditScheduler:
+    """
+    Edits the messages that keep themselves up to date, like the player, volume and now playing messages.
+
+    Edits to the same message are coalesced so that only the latest content gets sent, edits that wouldn't change
+    anything are skipped, and edits are rate limited per channel (discord allows 5 every 5 seconds) and overall.
+    Registered messages are re-rendered every `refresh_interval` seconds.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, refresh_interval: float = 10,
+                 channel_rate: tuple = (5, 5), global_rate: tuple = (10, 1)):
+        self.loop = loop
+        self.refresh_interval = refresh_interval
+        self.channel_rate, self.channel_per = channel_rate
+        self.global_rate, self.global_per = global_rate
+
+        self.live = {}  # message_id: (message, render)
+        self.pending = OrderedDict()  # message_id: (message, kwargs, fingerprint)
+        self.sent = {}  # message_id: fingerprint of what the message currently shows
+        self.channel_edits = defaultdict(deque)  # channel_id: times of recent edits
+        self.global_edits = deque()
+        self.stats = Counter()  # requested, coalesced, unchanged, sent, failed
+        self.wakeup = asyncio.Event()
+        self.tasks = [loop.create_task(self.dispatch()), loop.create_task(self.refresh_live())]
+
+    @staticmethod
+    def fingerprint(kwargs: dict):
+        return tuple(
+            (key, json.dumps(value.to_dict(), sort_keys=True) if isinstance(value, discord.Embed) else value)
+            for key, value in sorted(kwargs.items())
+        )
+
+    # public
+
+    def register(self, message: discord.Message, render):
+        """
+        Keeps a message up to date. `render` should return the kwargs for `message.edit`, or `None` to leave it as it is.
+        """
+        self.live[message.id] = (message, render)
+        if (kwargs := render()) is not None:
+            self.sent[message.id] = self.fingerprint(kwargs)
+
+    def unregister(self, message: discord.Message):
+        if message is None:
+            return
+        self.live.pop(message.id, None)
+        self.pending.pop(message.id, None)
+        self.sent.pop(message.id, None)
+
+    def refresh(self, message: discord.Message):
+        """
+        Re-renders a registered message straight away instead of waiting for the next refresh.
+        """
+        if message is not None and message.id in self.live:
+            self.render(message.id)
+            if message.id in self.pending:  # someone is waiting on this one, so it goes before the periodic refreshes
+                self.pending.move_to_end(message.id, last=False)
+                self.wakeup.set()
+
+    def schedule(self, message: discord.Message, **kwargs):
+        fingerprint = self.fingerprint(kwargs)
+        self.stats["requested"] += 1
+        if message.id in self.pending:
+            self.stats["coalesced"] += 1
+        elif self.sent.get(message.id) == fingerprint:
+            self.stats["unchanged"] += 1
+            return
+        self.pending[message.id] = (message, kwargs, fingerprint)
+        self.wakeup.set()
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+    # internal
+
+    def render(self, message_id: int):
+        """
+        Renders a registered message and schedules the edit. A message whose render raises is unregistered, so that
+        one broken message can't stop the others from being kept up to date.
+        """
+        message, render = self.live[message_id]
+        try:
+            if (kwargs := render()) is not None:
+                self.schedule(message, **kwargs)
+        except Exception:
+            log.exception("Rendering message %s failed, it won't be kept up to date any more", message_id)
+            self.stats["failed"] += 1
+            self.unregister(message)
+
+    def wait_time(self, channel_id: int, now: float):
+        """
+        Returns how long until another edit can be sent in a channel.
+        """
+        wait = 0
+        for edits, rate, per in ((self.global_edits, self.global_rate, self.global_per),
+                                 (self.channel_edits.get(channel_id, ()), self.channel_rate, self.channel_per)):
+            while edits and now - edits[0] >= per:
+                edits.popleft()
+            if len(edits) >= rate:
+                wait = max(wait, edits[0] + per - now)
+        if channel_id in self.channel_edits and not self.channel_edits[channel_id]:
+            del self.channel_edits[channel_id]
+        return wait
+
+    async def dispatch(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                now = time.monotonic()
+                # the oldest edit that can go out now, otherwise wait for the one that can go out soonest
+                waits = {message_id: self.wait_time(message.channel.id, now) for message_id, (message, _, _) in self.pending.items()}
+                message_id = min(waits, key=waits.get)
+                if waits[message_id] > 0:
+                    # wait until the edit can go out, or until a new or refreshed edit might be able to go out sooner
+                    self.wakeup.clear()
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self.wakeup.wait(), waits[message_id])
+                    continue
+
+                message, kwargs, fingerprint = self.pending.pop(message_id)
+                if self.sent.get(message_id) == fingerprint:
+                    self.stats["unchanged"] += 1
+                    continue
+                self.global_edits.append(now)
+                self.channel_edits[message.channel.id].append(now)
+                self.sent[message_id] = fingerprint
+                self.loop.create_task(self.edit(message, kwargs))
+
+    async def edit(self, message: discord.Message, kwargs: dict):
+        try:
+            await message.edit(**kwargs)
+            self.stats["sent"] += 1
+            if message.id not in self.live and message.id not in self.pending:
+                self.sent.pop(message.id, None)  # one-off edits aren't compared against later
+        except discord.NotFound:
+            self.unregister(message)
+        except discord.HTTPException:
+            self.stats["failed"] += 1
+            self.sent.pop(message.id, None)
+        except Exception:
+            log.exception("Editing message %s failed", message.id)
+            self.stats["failed"] += 1
+            self.sent.pop(message.id, None)
+
+    async def refresh_live(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            for message_id in list(self.live):
+                if message_id in self.live:  # an earlier render could have unregistered it
+                    self.render(message_id)
+
+
+class ReactionWaiter:
+    __slots__ = ("future", "message_id", "events", "emojis", "user_ids", "ignore_bots", "deadline")
+
+    def __init__(self, future: asyncio.Future, message_id: int, events: tuple, emojis, user_ids, ignore_bots: bool, deadline):
+        self.future = future
+        self.message_id = message_id
+        self.events = events
+        self.emojis = emojis
+        self.user_ids = user_ids
+        self.ignore_bots = ignore_bots
+        self.deadline = deadline
+
+    def check(self, event: str, payload: discord.RawReactionActionEvent):
+        return (event in self.events
+                and (self.emojis is None or str(payload.emoji) in self.emojis)
+                and (self.user_ids is None or payload.user_id in self.user_ids)
+                and not (self.ignore_bots and payload.member is not None and payload.member.bot))
+
+
+class ReactionRouter:
+    """
+    Hands raw reaction events to whatever is waiting on the message they were added to or removed from.
+
+    Unlike `bot.wait_for`, which runs the check of every waiter on every reaction, waiters are looked up by message id.
+    Timeouts go into a timer wheel of `slots` slots that are `resolution` seconds apart, so one task handles all of them.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, resolution: float = 1, slots: int = 512):
+        self.loop = loop
+        self.resolution = resolution
+        self.waiters = defaultdict(list)  # message_id: [ReactionWaiter, ...]
+        self.wheel = [[] for _ in range(slots)]
+        self.position = 0  # the slot the wheel is on
+        self.stats = Counter()  # routed, unrouted, timed out
+        self.task = loop.create_task(self.turn())
+
+    # public
+
+    async def wait_for(self, message: typing.Union[discord.Message, int], *, events: tuple = ("add",), emojis=None,
+                       user_ids=None, ignore_bots: bool = True, timeout: float = None):
+        """
+        Waits for a reaction on `message` and returns `(event, payload)`, where event is `"add"` or `"remove"`.
+
+        `emojis` and `user_ids` restrict which reactions count. Raises `asyncio.TimeoutError` like `bot.wait_for`.
+        """
+        message_id = getattr(message, "id", message)
+        deadline = self.loop.time() + timeout if timeout is not None else None
+        waiter = ReactionWaiter(self.loop.create_future(), message_id, events, emojis, user_ids, ignore_bots, deadline)
+        self.waiters[message_id].append(waiter)
+        if deadline is not None:
+            self.schedule(waiter)
+        try:
+            return await waiter.future
+        finally:
+            self.discard(waiter)
+
+    def dispatch(self, event: str, payload: discord.RawReactionActionEvent):
+        if (waiters := self.waiters.get(payload.message_id)) is None:
+            self.stats["unrouted"] += 1
+            return
+        self.stats["routed"] += 1
+        for waiter in waiters.copy():
+            if not waiter.future.done() and waiter.check(event, payload):
+                waiter.future.set_result((event, payload))
+                self.discard(waiter)
+
+    def close(self):
+        self.task.cancel()
+        for waiters in self.waiters.values():
+            for waiter in waiters:
+                waiter.future.cancel()
+        self.waiters.clear()
+
+    # internal
+
+    def discard(self, waiter: ReactionWaiter):
+        if (waiters := self.waiters.get(waiter.message_id)) is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del self.waiters[waiter.message_id]
+
+    def schedule(self, waiter: ReactionWaiter):
+        # waiters further away than one turn of the wheel get looked at once per turn until they're due
+        ticks = max(int((waiter.deadline - self.loop.time()) / self.resolution) + 1, 1)
+        self.wheel[(self.position + min(ticks, len(self.wheel) - 1)) % len(self.wheel)].append(waiter)
+
+    async def turn(self):
+        while True:
+            await asyncio.sleep(self.resolution)
+            self.position = (self.position + 1) % len(self.wheel)
+            due, self.wheel[self.position] = self.wheel[self.position], []
+            now = self.loop.time()
+            for waiter in due:
+                if waiter.future.done():
+                    continue
+                if waiter.deadline <= now:
+                    self.stats["timed out"] += 1
+                    waiter.future.set_exception(asyncio.TimeoutError())
+                    self.discard(waiter)
+                else:
+                    self.schedule(waiter)
+
+
+class SnakeScheduler:
+    """
+    Moves every running snake game from one task, with the edits going through the edit scheduler.
+
+    Games can use up to `edit_share` of the edit scheduler's overall rate limit, and the tick interval grows past
+    `interval` when there are more games than that allows. A game whose last frame hasn't been sent yet sits
+    the tick out, so a slow channel slows its game down instead of frames piling up.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, edit_scheduler: EditScheduler, *, interval: float = 1.5,
+                 edit_share: float = 0.5):
+        self.edit_scheduler = edit_scheduler
+        self.base_interval = interval
+        self.interval = interval
+        self.edit_share = edit_share
+        self.games = set()
+        self.stats = Counter()  # ticks, moves, waiting (the game's last frame was still pending), failed
+        self.task = loop.create_task(self.run())
+
+    def add(self, menu: SnakeMenu):
+        self.games.add(menu)
+
+    def remove(self, menu: SnakeMenu):
+        self.games.discard(menu)
+
+    def close(self):
+        self.task.cancel()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.tick()
+
+    def tick(self):
+        self.stats["ticks"] += 1
+        playing = [menu for menu in self.games if menu.direction is not None and menu.message is not None]
+        for menu in playing:
+            if menu.message.id in self.edit_scheduler.pending:
+                self.stats["waiting"] += 1
+                continue
+            try:
+                menu.game.update(menu.direction)
+                self.stats["moves"] += 1
+                self.edit_scheduler.schedule(menu.message, embed=menu.build_embed())
+            except Exception:
+                log.exception("Snake game in message %s failed, stopping it", menu.message.id)
+                self.stats["failed"] += 1
+                self.remove(menu)
+                menu.stop()
+                continue
+            if menu.game.lose:
+                self.remove(menu)
+                menu.stop()
+
+        edits_per_second = self.edit_share * self.edit_scheduler.global_rate / self.edit_scheduler.global_per
+        self.interval = max(self.base_interval, len(playing) / edits_per_second)
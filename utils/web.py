@@ -0,0 +1,627 @@
+import asyncio
+import aiohttp
+import aiohttp.web
+import codecs
+import datetime
+import hashlib
+import json
+import re
+import time
+
+from collections import Counter, OrderedDict, defaultdict, deque
+from urllib.parse import urlsplit, urlencode
+
+# constants
+
+DEFAULT_TTL = 60
+NEGATIVE_TTL = 60  # how long a 404 or 410 is cached for
+NEGATIVE_STATUSES = (404, 410)
+STALE_TTL = 86400  # how long expired responses are kept around for revalidation
+MAX_ENTRIES = 1000
+CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+TOTAL_TIMEOUT = 30
+CONNECTIONS_PER_HOST = 10
+TOTAL_CONNECTIONS = 100
+FAILURE_THRESHOLD = 5
+BREAKER_RESET_AFTER = 30
+LATENCY_SAMPLES = 100
+MAX_TRACKED_HOSTS = 500
+HEDGE_DELAY = 2  # start the next paste provider if the current one hasn't answered after this many seconds
+PASTE_KEY_LENGTH = 24
+PASTE_EXPIRE_AFTER = 30  # days
+STREAM_CHUNK_SIZE = 64 * 1024
+BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of making a request to a host that has been failing.
+    """
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Requests to {host} are paused for another {retry_after:.0f} seconds.")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised by `ResilientSession` when a request times out, can't connect or fails while its response is being read.
+    """
+    def __init__(self, host: str, error: Exception):
+        super().__init__(f"Request to {host} failed: {error.__class__.__name__}: {error}")
+        self.host = host
+        self.error = error
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures. Once `reset_after` seconds have passed a single trial request is
+    let through; if it succeeds the breaker closes again, otherwise it stays open for another `reset_after` seconds.
+    """
+    __slots__ = ("host", "threshold", "reset_after", "failures", "opened_at")
+
+    def __init__(self, host: str, *, threshold: int = FAILURE_THRESHOLD, reset_after: float = BREAKER_RESET_AFTER):
+        self.host = host
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_after:
+            return "open"
+        return "half-open"
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if elapsed < self.reset_after:
+            raise CircuitOpen(self.host, self.reset_after - elapsed)
+        self.opened_at = time.monotonic()  # half-open: let this request through and hold back the rest
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class HostStats:
+    __slots__ = ("breaker", "latencies", "requests", "failures")
+
+    def __init__(self, host: str):
+        self.breaker = CircuitBreaker(host)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def average(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    @property
+    def p95(self):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class _RequestContextManager:
+    __slots__ = ("client", "method", "url", "kwargs", "host", "response", "start")
+
+    def __init__(self, client, method: str, url, kwargs: dict):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self.host = urlsplit(str(url)).hostname
+        self.response = None
+        self.start = None
+
+    async def __aenter__(self):
+        if self.host is not None:
+            self.client.get_host(self.host).breaker.check()
+        self.start = time.perf_counter()
+        try:
+            self.response = await self.client.session.request(self.method, self.url, **self.kwargs)
+        except aiohttp.InvalidURL:
+            raise  # the caller's mistake, not the upstream's
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            if self.host is None:
+                raise
+            self._record(failed=isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)))
+            raise UpstreamUnavailable(self.host, error) from error
+        return self.response
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        failed = self.response.status >= 500 or (
+            exc_type is not None and issubclass(exc_type, (aiohttp.ClientConnectionError, asyncio.TimeoutError)))
+        self._record(failed=failed)
+        self.response.release()
+        # errors while reading the response (timeouts, raise_for_status) are the upstream's, not the caller's
+        if exc_type is not None and issubclass(exc_type, (aiohttp.ClientError, asyncio.TimeoutError)):
+            raise UpstreamUnavailable(self.host, exc_value) from exc_value
+
+    def _record(self, *, failed: bool):
+        if self.host is None:
+            return
+        host = self.client.get_host(self.host)
+        host.requests += 1
+        host.latencies.append(time.perf_counter() - self.start)
+        if failed:
+            host.failures += 1
+            host.breaker.record_failure()
+        else:
+            host.breaker.record_success()
+
+
+class ResilientSession:
+    """
+    Wrapper around `aiohttp.ClientSession` with timeouts, per-host connection limits, a circuit breaker per host and
+    per-host latency stats. `get`, `post` and `request` are used exactly like the session's, except that timeouts and
+    aiohttp errors are raised as `UpstreamUnavailable`. Invalid urls still raise `aiohttp.InvalidURL`.
+    """
+    def __init__(self, *, connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 total_timeout: float = TOTAL_TIMEOUT, limit_per_host: int = CONNECTIONS_PER_HOST,
+                 limit: int = TOTAL_CONNECTIONS):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+            timeout=aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout, sock_read=read_timeout))
+        self.hosts = OrderedDict()
+
+    def get_host(self, host: str):
+        if (stats := self.hosts.get(host)) is None:
+            stats = self.hosts[host] = HostStats(host)
+            if len(self.hosts) > MAX_TRACKED_HOSTS:
+                self.hosts.popitem(last=False)
+        self.hosts.move_to_end(host)
+        return stats
+
+    def request(self, method: str, url, **kwargs):
+        return _RequestContextManager(self, method, url, kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+
+class CachedResponse:
+    """
+    A fully read response that can be cached and shared between commands.
+    """
+    __slots__ = ("url", "status", "headers", "body", "expires")
+
+    def __init__(self, url: str, status: int, headers: dict, body: bytes, expires: float):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires
+
+    def json(self):
+        return json.loads(self.body)
+
+    def text(self, encoding: str = "utf-8"):
+        return self.body.decode(encoding, errors="replace")
+
+    def to_redis(self):
+        return {"url": self.url, "status": self.status, "headers": json.dumps(self.headers),
+                "body": self.body, "expires": self.expires}
+
+    @classmethod
+    def from_redis(cls, data: dict):
+        return cls(data[b"url"].decode(), int(data[b"status"]), json.loads(data[b"headers"]), data[b"body"],
+                   float(data[b"expires"]))
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into a single in-flight call, whose result (or exception) is handed
+    to every caller.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    def _forget(self, key, future: asyncio.Future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+
+    async def do(self, key, func, *args, **kwargs):
+        if (future := self.calls.get(key)) is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # shielded so one caller giving up doesn't cancel the request for everyone else
+        return await asyncio.shield(future)
+
+
+class HTTPCache:
+    """
+    Caching layer around an aiohttp session.
+
+    Responses are kept in memory (and optionally in redis) for a per-host TTL. Once a response expires it is
+    revalidated with `If-None-Match`/`If-Modified-Since`, so an unchanged resource only costs a 304.
+    Only 2xx responses are cached for the full TTL; 404s and 410s are cached for at most `NEGATIVE_TTL` seconds.
+    """
+    def __init__(self, session, *, redis=None, ttls: dict = None, default_ttl: int = DEFAULT_TTL,
+                 max_entries: int = MAX_ENTRIES):
+        self.session = session
+        self.redis = redis
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+
+        self.entries = OrderedDict()
+        self.flights = SingleFlight()
+        self.stats = defaultdict(Counter)  # host: {"hits": x, "revalidations": y, "misses": z}
+
+    @staticmethod
+    def make_key(url: str, params: dict = None, headers: dict = None):
+        key = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+        if headers:  # request headers like Accept or Authorization can change the response
+            key += "#" + urlencode(sorted((name.lower(), value) for name, value in headers.items()))
+        return key
+
+    def get_ttl(self, url: str):
+        return self.ttls.get(urlsplit(url).hostname, self.default_ttl)
+
+    # metrics
+
+    @property
+    def totals(self):
+        totals = Counter()
+        for counter in self.stats.values():
+            totals.update(counter)
+        return totals
+
+    @staticmethod
+    def hit_ratio(counter: Counter):
+        total = counter["hits"] + counter["revalidations"] + counter["misses"]
+        if not total:
+            return 0.0
+        return (counter["hits"] + counter["revalidations"]) / total
+
+    # storage
+
+    async def _load(self, key: str):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            if entry.fresh:
+                return entry
+        if self.redis is not None:
+            data = await self.redis.hgetall(f"http_cache:{key}")
+            if data:
+                redis_entry = CachedResponse.from_redis(data)
+                if entry is None or redis_entry.expires > entry.expires:  # another process refreshed it
+                    entry = redis_entry
+                    self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: CachedResponse):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def _store(self, key: str, entry: CachedResponse, ttl: int):
+        self._remember(key, entry)
+        if self.redis is not None:
+            await self.redis.hmset_dict(f"http_cache:{key}", entry.to_redis())
+            await self.redis.expire(f"http_cache:{key}", ttl + STALE_TTL)
+
+    # requests
+
+    async def get(self, url: str, *, params: dict = None, ttl: int = None, headers: dict = None):
+        """
+        GET a url, returning a `CachedResponse`. `ttl` overrides the per-host TTL for this request.
+        """
+        key = self.make_key(url, params, headers)
+        ttl = self.get_ttl(url) if ttl is None else ttl
+        stats = self.stats[urlsplit(url).hostname]
+
+        entry = await self._load(key)
+        if entry is not None and entry.fresh:
+            stats["hits"] += 1
+            return entry
+
+        # identical requests that arrive while this one is in flight share its response
+        return await self.flights.do(key, self._fetch, key, url, params, ttl, headers, entry, stats)
+
+    async def _fetch(self, key: str, url: str, params: dict, ttl: int, headers: dict, entry: CachedResponse,
+                     stats: Counter):
+        headers = dict(headers or {})
+        if entry is not None:
+            if etag := entry.headers.get("ETag"):
+                headers["If-None-Match"] = etag
+            if last_modified := entry.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = last_modified
+
+        async with self.session.get(url, params=params, headers=headers) as r:
+            if r.status == 304 and entry is not None:
+                stats["revalidations"] += 1
+                entry.expires = time.time() + ttl
+                await self._store(key, entry, ttl)
+                return entry
+            stats["misses"] += 1
+            if r.status in NEGATIVE_STATUSES:
+                ttl = min(ttl, NEGATIVE_TTL)
+            entry = CachedResponse(
+                str(r.url), r.status, {k: r.headers[k] for k in CACHED_HEADERS if k in r.headers}, await r.read(),
+                time.time() + ttl)
+
+        # only successful responses and missing resources are cached, so rate limits and other errors aren't served again
+        if 200 <= entry.status < 300 or entry.status in NEGATIVE_STATUSES:
+            await self._store(key, entry, ttl)
+        return entry
+
+
+# text streaming
+
+
+class TextTooLarge(Exception):
+    """
+    Raised while streaming once more than `limit` bytes have been read.
+    """
+    def __init__(self, limit: int):
+        super().__init__(f"Text is too large (>{limit:,} bytes).")
+        self.limit = limit
+
+
+class ByteBudget:
+    """
+    How many raw bytes can still be read, shared between streams so that a limit can cover several files.
+    """
+    __slots__ = ("limit", "remaining")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.remaining = limit
+
+    def spend(self, amount: int):
+        self.remaining -= amount
+        if self.remaining < 0:
+            raise TextTooLarge(self.limit)
+
+
+class TextDecoder:
+    """
+    Incremental decoder that picks the encoding from the first chunk: the BOM if there is one, otherwise utf-8,
+    falling back to cp1252 if the first chunk isn't valid utf-8. Bytes that are still undecodable later on are
+    replaced instead of raising.
+    """
+    def __init__(self):
+        self.decoder = None
+
+    def _detect(self, chunk: bytes):
+        for bom, encoding in BOMS:
+            if chunk.startswith(bom):
+                return codecs.getincrementaldecoder(encoding)(errors="replace")
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(chunk)
+        except UnicodeDecodeError:
+            return codecs.getincrementaldecoder("cp1252")(errors="replace")
+        return codecs.getincrementaldecoder("utf-8")()
+
+    def decode(self, chunk: bytes, final: bool = False):
+        if self.decoder is None:
+            if not chunk and not final:
+                return ""
+            self.decoder = self._detect(chunk)
+        try:
+            return self.decoder.decode(chunk, final)
+        except UnicodeDecodeError:  # looked like utf-8 at first; the failed call didn't consume anything
+            self.decoder.errors = "replace"
+            return self.decoder.decode(chunk, final)
+
+
+async def stream_text(session, url: str, *, limit, chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    Downloads a text file chunk by chunk, yielding decoded text. Raises `TextTooLarge` as soon as more than
+    `limit` raw bytes have been received. `limit` can be an int or a `ByteBudget` shared with other streams.
+    """
+    budget = limit if isinstance(limit, ByteBudget) else ByteBudget(limit)
+    decoder = TextDecoder()
+    async with session.get(url) as r:
+        r.raise_for_status()
+        if r.content_length is not None and r.content_length > budget.remaining:
+            raise TextTooLarge(budget.limit)
+        async for chunk in r.content.iter_chunked(chunk_size):
+            budget.spend(len(chunk))
+            if text := decoder.decode(chunk):
+                yield text
+    if text := decoder.decode(b"", final=True):
+        yield text
+
+
+# pastes
+
+
+class PasteFailed(Exception):
+    """
+    Raised when every paste provider failed.
+    """
+    def __init__(self, errors: dict):
+        super().__init__("Couldn't upload to any paste service.")
+        self.errors = errors
+
+
+class PasteProvider:
+    """
+    A paste site with a hastebin-style `/documents` endpoint.
+    """
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def average(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    async def paste(self, session, data):
+        async with session.post(f"{self.url}/documents", data=data) as r:
+            r.raise_for_status()
+            return f"{self.url}/{(await r.json())['key']}"
+
+
+class PasteStore:
+    """
+    Self-hosted paste storage. Pastes are content-addressed (so identical pastes are stored once), kept in
+    postgresql until they expire and served by a small aiohttp app.
+    """
+    key_regex = re.compile(rf"[0-9a-f]{{{PASTE_KEY_LENGTH}}}")
+
+    def __init__(self, pool, *, url: str, host: str = "0.0.0.0", port: int = 8080,
+                 expire_after: int = PASTE_EXPIRE_AFTER):
+        self.pool = pool
+        self.url = url.rstrip("/")
+        self.host = host
+        self.port = port
+        self.expire_after = datetime.timedelta(days=expire_after)
+        self.runner = None
+
+    async def save(self, content: str):
+        key = hashlib.sha256(content.encode("utf-8")).hexdigest()[:PASTE_KEY_LENGTH]
+        expires_at = datetime.datetime.utcnow() + self.expire_after
+        # pasting the same thing again just pushes the expiry back
+        await self.pool.execute(
+            "INSERT INTO pastes (key, content, expires_at) VALUES ($1, $2, $3) "
+            "ON CONFLICT (key) DO UPDATE SET expires_at = GREATEST(pastes.expires_at, EXCLUDED.expires_at)",
+            key, content, expires_at)
+        return f"{self.url}/{key}"
+
+    async def purge_expired(self):
+        await self.pool.execute("DELETE FROM pastes WHERE expires_at < $1", datetime.datetime.utcnow())
+
+    async def handle(self, request: aiohttp.web.Request):
+        key = request.match_info["key"]
+        if not self.key_regex.fullmatch(key):
+            raise aiohttp.web.HTTPNotFound()
+        # the content never changes for a given key, so the key doubles as the etag
+        etag = f'"{key}"'
+        if request.headers.get("If-None-Match") == etag:
+            return aiohttp.web.Response(status=304, headers={"ETag": etag})
+        row = await self.pool.fetchrow(
+            "SELECT content, expires_at FROM pastes WHERE key = $1 AND expires_at > $2", key, datetime.datetime.utcnow())
+        if row is None:
+            raise aiohttp.web.HTTPNotFound()
+        max_age = int((row["expires_at"] - datetime.datetime.utcnow()).total_seconds())
+        response = aiohttp.web.Response(
+            text=row["content"], content_type="text/plain", charset="utf-8",
+            headers={"ETag": etag, "Cache-Control": f"public, max-age={max_age}, immutable"})
+        response.enable_compression()  # gzip/deflate, depending on what the client accepts
+        return response
+
+    async def start(self):
+        app = aiohttp.web.Application()
+        app.router.add_get("/{key}", self.handle)
+        self.runner = aiohttp.web.AppRunner(app)
+        await self.runner.setup()
+        await aiohttp.web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+class StorePasteProvider(PasteProvider):
+    """
+    Paste provider backed by the bot's own `PasteStore`.
+    """
+    def __init__(self, store: PasteStore):
+        super().__init__("builtin", store.url)
+        self.store = store
+
+    async def paste(self, session, data):
+        if not isinstance(data, (str, bytes)):  # a stream; the whole paste is needed to hash it anyway
+            data = b"".join([chunk async for chunk in data])
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return await self.store.save(data)
+
+
+class PasteService:
+    """
+    Uploads to one of several paste providers. If the preferred provider hasn't answered within `hedge_delay`
+    seconds (or fails) the next one is started as well, and whichever succeeds first wins.
+    """
+    def __init__(self, session, providers: list, *, hedge_delay: float = HEDGE_DELAY):
+        self.session = session
+        self.providers = {provider.name: provider for provider in providers}
+        self.hedge_delay = hedge_delay
+
+    async def _paste(self, provider: PasteProvider, data):
+        start = time.perf_counter()
+        try:
+            url = await provider.paste(self.session, data)
+        except Exception:
+            provider.failures += 1
+            raise
+        provider.latencies.append(time.perf_counter() - start)
+        provider.successes += 1
+        return url
+
+    async def paste(self, data, *, prefer: str = None):
+        """
+        Pastes `data` and returns the url. Raises `PasteFailed` if no provider could take it.
+
+        `data` can also be an async iterable of bytes, which is streamed straight into the upload. A stream can only
+        be consumed once, so it isn't hedged: it goes to the preferred provider and any error is raised as is.
+        """
+        providers = sorted(self.providers.values(), key=lambda p: p.name != prefer)
+        if not isinstance(data, (str, bytes)):
+            return await self._paste(providers[0], data)
+        tasks_ = {}
+        errors = {}
+
+        def start_next():
+            if len(tasks_) + len(errors) < len(providers):
+                provider = providers[len(tasks_) + len(errors)]
+                tasks_[asyncio.ensure_future(self._paste(provider, data))] = provider
+
+        start_next()
+        try:
+            while tasks_:
+                done, _ = await asyncio.wait(tasks_, timeout=self.hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:  # too slow, hedge with the next provider
+                    start_next()
+                    continue
+                for task in done:
+                    provider = tasks_.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors[provider.name] = task.exception()
+                    start_next()
+        finally:
+            for task in tasks_:
+                task.cancel()
+        raise PasteFailed(errors)